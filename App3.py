@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from io import BytesIO
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pandas.api.types import is_datetime64_any_dtype as is_datetime
@@ -102,17 +103,17 @@ if uploaded_file is not None:
                 st.write(df)
                 
                 # Téléchargement des résultats
-                output = pd.ExcelWriter('resultats_avec_ttf.xlsx', engine='xlsxwriter')
-                df.to_excel(output, index=False)
-                output.close()
+                # Classeur construit en mémoire : pas de fichier partagé entre sessions
+                output = BytesIO()
+                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+                    df.to_excel(writer, index=False)
                 
-                with open('resultats_avec_ttf.xlsx', 'rb') as f:
-                    st.download_button(
-                        label="Télécharger les résultats",
-                        data=f,
-                        file_name='resultats_avec_ttf.xlsx',
-                        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                    )
+                st.download_button(
+                    label="Télécharger les résultats",
+                    data=output.getvalue(),
+                    file_name='resultats_avec_ttf.xlsx',
+                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                )
     
     except Exception as e:
         st.error(f"Erreur lors du traitement: {str(e)}")
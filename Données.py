@@ -1,9 +1,20 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime
-import os
+from datetime import date
+from io import BytesIO
+import xlsxwriter
+from common import EXCEL_ENGINE, write_sheet
+
+# Colonnes de dates converties et libellés des messages
+DATE_COLUMNS = {
+    'installationDate': 'Date installation',
+    'incidentDate': 'Date incident',
+    'Lastconnexion': 'Dernière connexion'
+}
 
 def main():
     st.title("📊 Analyse des Appareils Techniques")
@@ -13,8 +24,8 @@ def main():
     
     if uploaded_file is not None:
         try:
-            # Lecture du fichier
-            df = pd.read_excel(uploaded_file)
+            # Lecture du fichier (mise en cache sur le contenu)
+            df = load_excel(uploaded_file.getvalue())
             
             # Vérification des colonnes
             required_columns = [
@@ -29,17 +40,28 @@ def main():
                 return
             
             # Préparation des données
-            df = prepare_data(df)
+            # Date du jour passée en argument : elle fait partie de la clé du cache
+            df = prepare_data(df, date.today())
+            
+            # Messages affichés à chaque exécution, hors de la fonction en cache
+            for col, label in DATE_COLUMNS.items():
+                nb_errors = df[col].isnull().sum()
+                if nb_errors:
+                    st.warning(f"{nb_errors} {label} non converties (format invalide)")
+            if 'Time_to_Failure' in df:
+                st.success(f"Time to Failure calculé pour {len(df)} appareils")
+            if 'Age_appareil' in df:
+                st.success(f"Âge des appareils calculé pour {len(df)} appareils")
             
             # Sidebar avec filtres
             st.sidebar.header("Filtres")
             
-            # Filtre par modèle
-            model_list = ['Tous'] + sorted(df['modèle'].unique().tolist())
+            # Filtre par modèle (catégories déjà uniques et triées)
+            model_list = ['Tous'] + df['modèle'].cat.categories.tolist()
             model_filter = st.sidebar.selectbox("Modèle", model_list)
             
             # Filtre par filiale
-            filiale_list = ['Tous'] + sorted(df['filiale'].unique().tolist())
+            filiale_list = ['Tous'] + df['filiale'].cat.categories.tolist()
             filiale_filter = st.sidebar.selectbox("Filiale", filiale_list)
             
             # Application des filtres
@@ -95,49 +117,56 @@ def main():
         except Exception as e:
             st.error(f"Erreur lors du traitement: {str(e)}")
 
-def prepare_data(df):
+@st.cache_data(show_spinner=False)
+def load_excel(file_bytes):
+    return pd.read_excel(BytesIO(file_bytes), engine=EXCEL_ENGINE)
+
+@st.cache_data(show_spinner=False)
+def prepare_data(df, today):
     # Conversion robuste des dates
-    date_columns = {
-        'installationDate': 'Date installation',
-        'incidentDate': 'Date incident',
-        'Lastconnexion': 'Dernière connexion'
-    }
-    
-    for col, label in date_columns.items():
+    for col, label in DATE_COLUMNS.items():
         try:
-            # Conversion en datetime avec gestion d'erreur
-            df[col] = pd.to_datetime(df[col], errors='coerce', dayfirst=True)
-            
-            # Vérification des conversions
-            if df[col].isnull().any():
-                nb_errors = df[col].isnull().sum()
-                st.warning(f"{nb_errors} {label} non converties (format invalide)")
+            # Conversion en datetime : colonnes déjà datées laissées telles quelles,
+            # format jj/mm/aaaa fixe puis parseur générique pour le reste
+            if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                parsed = pd.to_datetime(df[col], format='%d/%m/%Y', errors='coerce')
+                remaining = parsed.isna() & df[col].notna()
+                if remaining.any():
+                    parsed[remaining] = pd.to_datetime(df.loc[remaining, col], errors='coerce', dayfirst=True)
+                df[col] = parsed
         except Exception as e:
             st.error(f"Erreur conversion {label}: {str(e)}")
             raise
     
     # Calcul du Time to Failure (date incident - date installation)
     if 'installationDate' in df and 'incidentDate' in df:
-        df['Time_to_Failure'] = (df['incidentDate'] - df['installationDate']).dt.days
-        st.success(f"Time to Failure calculé pour {len(df)} appareils")
+        delta = df['incidentDate'].to_numpy() - df['installationDate'].to_numpy()
+        df['Time_to_Failure'] = np.floor(delta / np.timedelta64(1, 'D'))
     
     # Calcul de l'âge (aujourd'hui - date installation)
     if 'installationDate' in df:
-        df['Age_appareil'] = (datetime.now() - df['installationDate']).dt.days
-        st.success(f"Âge des appareils calculé pour {len(df)} appareils")
+        delta = np.datetime64(today, 'ns') - df['installationDate'].to_numpy()
+        df['Age_appareil'] = np.floor(delta / np.timedelta64(1, 'D'))
+    
+    # Modèle et filiale en catégories : filtres évalués sur les codes entiers
+    for col in ('modèle', 'filiale'):
+        df[col] = df[col].astype('category')
     
     return df
 
+@st.cache_data(show_spinner=False)
 def apply_filters(df, model, filiale):
-    filtered = df.copy()
+    # Aucun filtre actif : le DataFrame est renvoyé tel quel
+    if model == 'Tous' and filiale == 'Tous':
+        return df
     
+    # Masque booléen unique, sans copie préalable du DataFrame
+    mask = np.ones(len(df), dtype=bool)
     if model != 'Tous':
-        filtered = filtered[filtered['modèle'] == model]
-    
+        mask &= (df['modèle'] == model).to_numpy()
     if filiale != 'Tous':
-        filtered = filtered[filtered['filiale'] == filiale]
-    
-    return filtered
+        mask &= (df['filiale'] == filiale).to_numpy()
+    return df if mask.all() else df.loc[mask]
 
 def plot_pie_chart(df, column, title):
     if column not in df or df[column].isnull().all():
@@ -146,6 +175,10 @@ def plot_pie_chart(df, column, title):
     
     fig, ax = plt.subplots()
     counts = df[column].value_counts()
+    # Catégories absentes après filtrage (compte nul) retirées, libellés en texte
+    # pour pouvoir ajouter 'Autres'
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(str)
     if len(counts) > 10:
         # Regrouper les petites catégories
         threshold = counts.sum() * 0.02  # 2%
@@ -159,47 +192,59 @@ def plot_pie_chart(df, column, title):
     ax.set_ylabel('')
     st.pyplot(fig)
 
-def plot_histogram(df, column, title, xlabel, ylabel):
+@st.cache_data(show_spinner=False)
+def histogram_bins(values, bins=20):
+    # Effectifs et bornes calculés une seule fois avec numpy
+    return np.histogram(values.dropna().to_numpy(dtype='float32'), bins=bins)
+
+def histogram_figure(values, title, xlabel, ylabel):
+    # Nouvelle figure à chaque appel : rien n'est partagé entre sessions
+    counts, edges = histogram_bins(values)
     fig, ax = plt.subplots()
-    sns.histplot(data=df, x=column, bins=20, kde=True, ax=ax)
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', edgecolor='white')
     ax.set_title(title)
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
+    return fig
+
+def plot_histogram(df, column, title, xlabel, ylabel):
+    fig = histogram_figure(df[column], title, xlabel, ylabel)
     st.pyplot(fig)
+    plt.close(fig)
 
 def export_data(df):
-    # Création du fichier Excel
-    output_path = 'analyse_appareils.xlsx'
+    # Création du fichier Excel en mémoire (pas de fichier temporaire)
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy'
+    })
     
-    with pd.ExcelWriter(output_path) as writer:
-        # Données complètes
-        df.to_excel(writer, sheet_name='Données', index=False)
-        
-        # Statistiques
-        stats_data = {
-            'Statistique': ['Nombre total', 'Modèle le plus courant', 'Filiale la plus courante',
-                           'Time to Failure moyen (jours)', 'Âge moyen (jours)'],
-            'Valeur': [
-                len(df),
-                df['modèle'].mode()[0] if 'modèle' in df else 'N/A',
-                df['filiale'].mode()[0] if 'filiale' in df else 'N/A',
-                round(df['Time_to_Failure'].mean(), 1) if 'Time_to_Failure' in df else 'N/A',
-                round(df['Age_appareil'].mean(), 1) if 'Age_appareil' in df else 'N/A'
-            ]
-        }
-        pd.DataFrame(stats_data).to_excel(writer, sheet_name='Statistiques', index=False)
+    # Données complètes
+    write_sheet(workbook, 'Données', df)
     
-    # Téléchargement
-    with open(output_path, 'rb') as f:
-        st.download_button(
-            label="Télécharger l'analyse complète",
-            data=f,
-            file_name='analyse_appareils_techniques.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+    # Statistiques
+    stats_data = {
+        'Statistique': ['Nombre total', 'Modèle le plus courant', 'Filiale la plus courante',
+                       'Time to Failure moyen (jours)', 'Âge moyen (jours)'],
+        'Valeur': [
+            len(df),
+            df['modèle'].mode()[0] if 'modèle' in df else 'N/A',
+            df['filiale'].mode()[0] if 'filiale' in df else 'N/A',
+            round(df['Time_to_Failure'].mean(), 1) if 'Time_to_Failure' in df else 'N/A',
+            round(df['Age_appareil'].mean(), 1) if 'Age_appareil' in df else 'N/A'
+        ]
+    }
+    write_sheet(workbook, 'Statistiques', pd.DataFrame(stats_data))
+    workbook.close()
     
-    # Nettoyage
-    os.remove(output_path)
+    # Téléchargement
+    st.download_button(
+        label="Télécharger l'analyse complète",
+        data=output.getvalue(),
+        file_name='analyse_appareils_techniques.xlsx',
+        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
 
 if __name__ == "__main__":
     main()
@@ -1,81 +1,133 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from datetime import datetime
+import re
 from io import BytesIO
 
 # Configuration de la page
 st.set_page_config(page_title="Outil de prétraitement", layout="wide")
 st.title("📊 Outil de prétraitement des données")
 
-# Fonction pour convertir les dates
-def convert_date_format(date_str):
-    """Convertit une date de format 'aaaa-mm-jj hh:mm:ss.ms' vers 'jj/mm/aaaa'"""
-    try:
-        dt = datetime.strptime(str(date_str), '%Y-%m-%d %H:%M:%S.%f')
-        return dt.strftime('%d/%m/%Y')
-    except ValueError:
-        try:
-            dt = datetime.strptime(str(date_str), '%Y-%m-%d %H:%M:%S')
-            return dt.strftime('%d/%m/%Y')
-        except ValueError:
-            return np.nan
+# Motifs de date compilés une seule fois (complet, et date seule pour l'export)
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+DAY_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
 
-# Fonction de validation des numéros de série
-def valider_numero_serie(num_serie):
-    """Valide un numéro de série selon les règles spécifiées"""
-    num_str = str(num_serie).strip()
-    
-    # Nettoyage des caractères spéciaux
-    special_chars = {
-        '¹': '1', '²': '2', '³': '3', '⁴': '4', '⁵': '5',
-        '⁶': '6', '⁷': '7', '⁸': '8', '⁹': '9', '⁰': '0'
-    }
-    cleaned_str = ''.join([special_chars.get(c, c) for c in num_str])
-    
-    # Validation
-    if len(cleaned_str) != 7 or not cleaned_str.isdigit():
-        return "Invalide (longueur)"
+# Table de traduction des exposants et indices, construite une seule fois
+SPECIAL_CHARS = str.maketrans({
+    '¹': '1', '²': '2', '³': '3', '⁴': '4', '⁵': '5',
+    '⁶': '6', '⁷': '7', '⁸': '8', '⁹': '9', '⁰': '0'
+})
+
+# Fonction de détection des colonnes de date
+def detect_date_columns(df, pattern=DATE_PATTERN, sample=200, exclude=()):
+    """Colonnes datetime, plus colonnes texte dont un échantillon correspond au motif"""
+    date_cols = [col for col in df.select_dtypes(include=['datetime']).columns if col not in exclude]
+    for col in df.select_dtypes(include=['object']).columns:
+        if col in exclude:
+            continue
+        if df[col].dropna().head(sample).astype(str).str.contains(pattern).any():
+            date_cols.append(col)
+    return date_cols
+
+# Fonction pour convertir les dates (mise en cache sur le contenu de la colonne)
+@st.cache_data(show_spinner=False)
+def convert_date_format(series):
+    """Convertit une colonne de dates 'aaaa-mm-jj hh:mm:ss[.ms]' vers 'jj/mm/aaaa' (NaN si invalide)"""
+    with_ms = pd.to_datetime(series, format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
+    without_ms = pd.to_datetime(series, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    return with_ms.fillna(without_ms).dt.strftime('%d/%m/%Y')
+
+# Fonction de validation des numéros de série (mise en cache sur le contenu de la colonne)
+@st.cache_data(show_spinner=False)
+def valider_numero_serie(series):
+    """Valide une colonne de numéros de série selon les règles spécifiées"""
+    # Nettoyage des caractères spéciaux (exposants et indices -> chiffres)
+    cleaned = series.astype(object).astype(str).str.strip().str.translate(SPECIAL_CHARS)
     
-    chiffres = [int(c) for c in cleaned_str]
-    deux_premiers = chiffres[0]*10 + chiffres[1]
-    trois_quatre = chiffres[2]*10 + chiffres[3]
+    # Règles évaluées sur toute la colonne
+    longueur_ok = cleaned.str.len().eq(7) & cleaned.str.isdigit()
+    deux_premiers = pd.to_numeric(cleaned.str.slice(0, 2), errors='coerce')
+    trois_quatre = pd.to_numeric(cleaned.str.slice(2, 4), errors='coerce')
     
-    if deux_premiers > 12:
-        return "Invalide (2 premiers > 12)"
-    if trois_quatre < 17 or trois_quatre > 26:
-        return "Invalide (chiffres 3-4 hors 17-26)"
+    statut = np.select(
+        [~longueur_ok, deux_premiers > 12, (trois_quatre < 17) | (trois_quatre > 26)],
+        ["Invalide (longueur)", "Invalide (2 premiers > 12)", "Invalide (chiffres 3-4 hors 17-26)"],
+        default="Valide"
+    )
+    return pd.Series(statut, index=series.index)
+
+# Fonction de chargement mise en cache sur le contenu du fichier
+@st.cache_data(show_spinner=False)
+def load_file(name, data):
+    """Lit un fichier CSV ou Excel téléversé"""
+    bio = BytesIO(data)
+    # Numéros de série lus comme texte : zéros de tête conservés, pas d'inférence
+    dtype = {'no de série': str}
+    if name.endswith('.csv'):
+        df = pd.read_csv(bio, dtype=dtype)
+    else:
+        df = pd.read_excel(bio, dtype=dtype)
     
-    return "Valide"
+    # Clés de dédoublonnage : chaînes Arrow et catégories plutôt qu'objets Python
+    if 'no de série' in df.columns:
+        df['no de série'] = df['no de série'].astype('string[pyarrow]')
+    if 'modèle' in df.columns:
+        df['modèle'] = df['modèle'].astype('category')
+    return df
+
+# Dédoublonnage mis en cache : re-clics et reruns servis sans recalcul
+@st.cache_data(show_spinner=False)
+def drop_duplicate_serials(df):
+    """Supprime les doublons (modèle, no de série) puis trie par numéro de série"""
+    # Dédoublonnage par hachage (première occurrence du fichier), puis tri
+    # stable du seul résultat
+    return df.drop_duplicates(subset=['modèle', 'no de série'], keep='first').sort_values(
+        'no de série', kind='stable')
+
+# Export Excel en mémoire, mis en cache sur le contenu du DataFrame
+@st.cache_data(show_spinner=False)
+def to_xlsx_bytes(df):
+    """Sérialise un DataFrame en classeur Excel"""
+    buf = BytesIO()
+    with pd.ExcelWriter(buf, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False)
+    return buf.getvalue()
 
 # Section 1: Upload du fichier
 with st.expander("1. Chargement des données", expanded=True):
     uploaded_file = st.file_uploader("Téléversez votre fichier (CSV ou Excel)", type=['csv', 'xlsx', 'xls'])
+    df = None
     
     if uploaded_file is not None:
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
+        # Chargement des données (DataFrame de travail conservé dans la session)
+        # Identifiant du téléversement : un fichier corrigé de même nom et taille est rechargé
+        source = uploaded_file.file_id
+        if st.session_state.get('df_source') != source:
+            st.session_state['df'] = load_file(uploaded_file.name, uploaded_file.getvalue())
+            st.session_state['df_source'] = source
+            st.session_state['converted_dates'] = set()
+        df = st.session_state['df']
         
         st.success(f"Fichier {uploaded_file.name} chargé avec succès!")
         st.dataframe(df.head())
 
 # Traitement si fichier chargé
-if 'df' in locals():
+if df is not None:
     # Section 2: Conversion des dates
     with st.expander("2. Conversion des dates"):
         # Détection automatique des colonnes de date
-        date_columns = [col for col in df.columns 
-                       if df[col].astype(str).str.contains(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}').any()]
+        date_columns = detect_date_columns(df)
         
         if date_columns:
             selected_dates = st.multiselect("Sélectionnez les colonnes à convertir", 
                                           date_columns, default=date_columns)
             
             if st.button("Convertir les dates"):
-                for col in selected_dates:
-                    df[col] = df[col].apply(convert_date_format)
+                # Nouveau DataFrame de travail, réenregistré dans la session
+                df = df.assign(**{col: convert_date_format(df[col]) for col in selected_dates})
+                st.session_state['df'] = df
+                # Colonnes déjà au format jj/mm/aaaa, ignorées à l'export
+                st.session_state.setdefault('converted_dates', set()).update(selected_dates)
                 st.success("Conversion terminée!")
                 st.dataframe(df[selected_dates].head())
         else:
@@ -84,14 +136,17 @@ if 'df' in locals():
     # Section 3: Validation des numéros de série
     with st.expander("3. Validation des numéros de série"):
         if 'no de série' in df.columns:
-            df['Validation S/N'] = df['no de série'].apply(valider_numero_serie)
+            df['Validation S/N'] = valider_numero_serie(df['no de série'])
             st.write("Répartition des statuts:")
-            st.bar_chart(df['Validation S/N'].value_counts())
+            status_counts = df['Validation S/N'].value_counts()
+            st.bar_chart(status_counts)
             
-            invalid = df[df['Validation S/N'] != "Valide"]
-            if not invalid.empty:
-                st.write(f"{len(invalid)} numéros invalides trouvés")
-                st.dataframe(invalid[['no de série', 'Validation S/N']].head())
+            # Nombre d'invalides déduit des comptes, lignes sélectionnées par masque numpy
+            n_invalid = len(df) - status_counts.get("Valide", 0)
+            if n_invalid:
+                invalid_mask = df['Validation S/N'].to_numpy() != "Valide"
+                st.write(f"{n_invalid} numéros invalides trouvés")
+                st.dataframe(df.loc[invalid_mask, ['no de série', 'Validation S/N']].head())
         else:
             st.warning("Colonne 'no de série' introuvable")
 
@@ -102,8 +157,8 @@ if 'df' in locals():
             st.write(f"Nombre de doublons trouvés : {dup_count}")
             
             if st.button("Supprimer les doublons"):
-                df = df.sort_values('no de série').drop_duplicates(
-                    subset=['modèle', 'no de série'], keep='first')
+                df = drop_duplicate_serials(df)
+                st.session_state['df'] = df
                 st.success(f"{dup_count} doublons supprimés")
                 st.dataframe(df.head())
         else:
@@ -113,29 +168,38 @@ if 'df' in locals():
     with st.expander("5. Exporter les données traitées"):
         # Conversion finale avant export
         def prepare_export(df):
-            """Convertit toutes les dates avant export"""
-            date_cols = [col for col in df.columns 
-                        if df[col].astype(str).str.contains(r'\d{4}-\d{2}-\d{2}').any()]
-            for col in date_cols:
-                df[col] = df[col].apply(convert_date_format)
-            return df
+            """Convertit toutes les dates avant export (sans modifier df)"""
+            # Colonnes converties en section 2 non réanalysées
+            date_cols = detect_date_columns(df, DAY_PATTERN,
+                                            exclude=st.session_state.get('converted_dates', ()))
+            # Seules les colonnes modifiées sont recréées, le reste est partagé avec df
+            changes = {col: convert_date_format(df[col]) for col in date_cols}
+            return df.assign(**changes) if changes else df
         
-        export_format = st.radio("Format d'export", ['Excel', 'CSV'])
+        export_format = st.radio("Format d'export", ['Excel', 'CSV', 'Parquet'])
         filename = st.text_input("Nom du fichier", "donnees_pretraitees")
         
         if st.button("Générer le fichier d'export"):
-            df_export = prepare_export(df.copy())
+            df_export = prepare_export(df)
             output = BytesIO()
             
             if export_format == 'Excel':
                 filename += '.xlsx'
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    df_export.to_excel(writer, index=False)
+                output.write(to_xlsx_bytes(df_export))
                 mime = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            else:
+            elif export_format == 'CSV':
                 filename += '.csv'
                 output.write(df_export.to_csv(index=False).encode('utf-8'))
                 mime = 'text/csv'
+            else:
+                # Export rapide : colonnes Arrow compressées, sans encodage XML
+                filename += '.parquet'
+                # Colonnes objet de types mélangés (nombres et texte) écrites en texte,
+                # valeurs manquantes conservées : Arrow refuse les colonnes hétérogènes
+                text_cols = df_export.select_dtypes(include=['object']).columns
+                df_export.astype({col: 'string' for col in text_cols}).to_parquet(
+                    output, engine='pyarrow', compression='zstd', index=False)
+                mime = 'application/vnd.apache.parquet'
             
             st.download_button(
                 "Télécharger le fichier",
@@ -25,27 +25,41 @@ def process_data(uploaded_file):
                     df[col] = pd.to_datetime(df[col], errors='coerce')
 
         # Fusionner les données
+        # Les agrégats gardent le numéro de série en index (trié et unique après groupby)
         incidents_agg = df_incidents.groupby('no de série').agg(
             nombre_incidents=('# incident', 'count'),
             dernier_incident=('date incident', 'max')
-        ).reset_index()
+        )
 
         retours_agg = df_retours.groupby('no de série').agg(
             nombre_retours=('référence RMA', 'count'),
             dernier_retour=('date rma', 'max'),
             RMA=('référence RMA', 'last')
-        ).reset_index()
-
-        df_final = df_install.merge(
-            incidents_agg, 
-            on='no de série', 
-            how='left'
-        ).merge(
-            retours_agg, 
-            on='no de série', 
-            how='left'
         )
 
+        # Jointure directe sur l'index des agrégats, sans reset_index ; l'ordre
+        # des lignes d'installation est conservé
+        if df_install['no de série'].is_monotonic_increasing:
+            # Numéros attribués dans l'ordre de fabrication : deux index triés,
+            # fusion linéaire sans table de hachage (aucun tri, l'ordre est déjà le bon)
+            df_final = df_install.set_index('no de série', drop=False).join(
+                incidents_agg,
+                how='left'
+            ).join(
+                retours_agg,
+                how='left'
+            ).set_axis(df_install.index)
+        else:
+            df_final = df_install.join(
+                incidents_agg,
+                on='no de série',
+                how='left'
+            ).join(
+                retours_agg,
+                on='no de série',
+                how='left'
+            )
+
         # Calculs supplémentaires
         df_final['nombre_incidents'] = df_final['nombre_incidents'].fillna(0)
         df_final['nombre_retours'] = df_final['nombre_retours'].fillna(0)
@@ -53,6 +67,10 @@ def process_data(uploaded_file):
         df_final['jours_inactivite'] = (datetime.now() - df_final['dernière connexion']).dt.days
         df_final['a_incident_sans_retour'] = (df_final['nombre_incidents'] > 0) & (df_final['nombre_retours'] == 0)
 
+        # Colonnes de regroupement en catégories (groupby sur codes entiers)
+        for col in ['modèle', 'filiale']:
+            df_final[col] = df_final[col].astype('category')
+
         return df_final
     
     except Exception as e:
@@ -73,7 +91,7 @@ def generate_stats(df):
     }
     
     # Par modèle
-    stats['par_modele'] = df.groupby('modèle').agg({
+    stats['par_modele'] = df.groupby('modèle', observed=True).agg({
         'no de série': 'count',
         'nombre_incidents': 'sum',
         'nombre_retours': 'sum',
@@ -86,7 +104,7 @@ def generate_stats(df):
     })
     
     # Par pays
-    stats['par_pays'] = df.groupby('filiale').agg({
+    stats['par_pays'] = df.groupby('filiale', observed=True).agg({
         'no de série': 'count',
         'nombre_incidents': 'sum',
         'nombre_retours': 'sum'
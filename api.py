@@ -1,12 +1,82 @@
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
+import xlsxwriter
+from common import write_sheet
 from io import BytesIO
 from datetime import datetime
 
 # Configuration de la page
 st.set_page_config(page_title="Analyse Produits", layout="wide", page_icon="📊")
 
+def fig_to_png(fig):
+    """Rastérise une figure en PNG et libère la figure"""
+    buf = BytesIO()
+    fig.savefig(buf, format='png', dpi=90, bbox_inches='tight')
+    plt.close(fig)
+    return buf.getvalue()
+
+@st.cache_data(show_spinner=False)
+def repartition_png(model_counts, filiale_counts):
+    """Graphique de répartition par modèle et par pays (PNG mis en cache)"""
+    fig, ax = plt.subplots(1, 2, figsize=(12, 4))
+    model_counts.plot(kind='bar', ax=ax[0])
+    ax[0].set_title('Répartition par modèle')
+    filiale_counts.plot(kind='bar', ax=ax[1])
+    ax[1].set_title('Répartition par pays')
+    return fig_to_png(fig)
+
+@st.cache_data(show_spinner=False)
+def installations_png(monthly):
+    """Courbe des installations par mois (PNG mis en cache)"""
+    fig, ax = plt.subplots(figsize=(10, 4))
+    monthly.plot(kind='line', marker='o', ax=ax)
+    ax.set_title('Installations par mois')
+    return fig_to_png(fig)
+
+def format_dates(df):
+    """Formate les colonnes datetime en jj/mm/aaaa pour l'affichage"""
+    date_cols = df.select_dtypes(include=['datetime']).columns
+    return df.assign(**{col: df[col].dt.strftime('%d/%m/%Y') for col in date_cols})
+
+def normalize_serials(series):
+    """Numéros de série en chaînes Arrow, les nombres entiers lus en float (123.0) écrits '123'"""
+    text = series.astype('string')
+    if pd.api.types.is_numeric_dtype(series):
+        numbers = series
+    else:
+        # Seules les cellules numériques sont normalisées, le texte ('0123') reste intact
+        numbers = pd.to_numeric(series.where(series.map(type).isin([int, float])), errors='coerce')
+    integral = numbers.notna() & (numbers % 1 == 0)
+    text[integral] = numbers[integral].astype('int64').astype('string')
+    return text.astype('string[pyarrow]')
+
+def load_sheet(uploaded_file, sheet_name):
+    """Charge une feuille Excel, conservée en Parquet dans la session"""
+    # Clé sur l'identifiant du téléversement : un nouveau fichier de même nom et
+    # de même taille n'est pas confondu avec le précédent
+    key = (uploaded_file.file_id, sheet_name)
+    cache = st.session_state.setdefault('sheet_parquet', {})
+    # Seules les feuilles du fichier courant restent en session
+    for stale in [k for k in cache if k[0] != uploaded_file.file_id]:
+        del cache[stale]
+    if key not in cache:
+        df = pd.read_excel(uploaded_file, sheet_name=sheet_name)
+        # Numéro de série en chaînes Arrow : clés de fusion et découpages plus rapides
+        if 'no_serie' in df.columns:
+            df['no_serie'] = normalize_serials(df['no_serie'])
+        try:
+            buf = BytesIO()
+            df.to_parquet(buf, engine='pyarrow')
+            cache[key] = buf.getvalue()
+        except (TypeError, ValueError):
+            # Colonnes de types mélangés non sérialisables : DataFrame gardé tel quel
+            cache[key] = df
+    data = cache[key]
+    if isinstance(data, bytes):
+        return pd.read_parquet(BytesIO(data), engine='pyarrow')
+    return data.copy()
+
 def main():
     st.title("📊 Analyse des Données Produits")
     st.markdown("""
@@ -44,9 +114,9 @@ def main():
 
             # Chargement des données
             dfs = {
-                'installations': pd.read_excel(uploaded_file, sheet_name=inst_sheet),
-                'incidents': pd.read_excel(uploaded_file, sheet_name=inc_sheet),
-                'rma': pd.read_excel(uploaded_file, sheet_name=rma_sheet)
+                'installations': load_sheet(uploaded_file, inst_sheet),
+                'incidents': load_sheet(uploaded_file, inc_sheet),
+                'rma': load_sheet(uploaded_file, rma_sheet)
             }
             st.session_state.dfs = dfs
 
@@ -65,12 +135,13 @@ def main():
                         converted_dfs = {}
                         date_columns = ['date_installation', 'derniere_connexion', 'date_incident', 'date_rma']
                         
+                        # Les dates restent en datetime64 ; le format jj/mm/aaaa n'est
+                        # appliqué qu'à l'affichage et à l'export
                         for name, df in dfs.items():
                             df_converted = df.copy()
                             for col in df_converted.columns:
                                 if any(date_col in col.lower() for date_col in date_columns):
                                     df_converted[col] = pd.to_datetime(df_converted[col], errors='coerce')
-                                    df_converted[col] = df_converted[col].dt.strftime('%d/%m/%Y')
                             converted_dfs[name] = df_converted
                         
                         st.session_state.converted_dfs = converted_dfs
@@ -78,7 +149,7 @@ def main():
                         
                         # Afficher un exemple de dates converties
                         with st.expander("Voir un exemple de dates converties", expanded=False):
-                            st.dataframe(converted_dfs['installations'].filter(like='date').head(3))
+                            st.dataframe(format_dates(converted_dfs['installations'].filter(like='date').head(3)))
                     except Exception as e:
                         st.error(f"Erreur lors de la conversion : {str(e)}")
 
@@ -106,32 +177,35 @@ def main():
                 with cols[3]:
                     if 'date_installation' in df_stats.columns:
                         min_date = df_stats['date_installation'].min()
-                        st.metric("Date installation min", min_date)
+                        st.metric("Date installation min",
+                                  min_date.strftime('%d/%m/%Y') if pd.notna(min_date) else 'N/A')
                 
                 # Graphiques
                 tab1, tab2, tab3 = st.tabs(["Répartition", "Tendances", "Détails"])
                 
+                # Chaque onglet n'est calculé que si l'utilisateur l'active
                 with tab1:
-                    fig, ax = plt.subplots(1, 2, figsize=(12, 4))
-                    df_stats['modèle'].value_counts().plot(kind='bar', ax=ax[0])
-                    ax[0].set_title('Répartition par modèle')
-                    df_stats['filiale'].value_counts().plot(kind='bar', ax=ax[1])
-                    ax[1].set_title('Répartition par pays')
-                    st.pyplot(fig)
+                    if st.toggle("Afficher la répartition", key='show_repartition'):
+                        st.image(repartition_png(
+                            df_stats['modèle'].value_counts(),
+                            df_stats['filiale'].value_counts()
+                        ), use_container_width=True)
                 
                 with tab2:
-                    if 'date_installation' in df_stats.columns:
-                        df_temp = df_stats.copy()
-                        df_temp['date_installation'] = pd.to_datetime(df_temp['date_installation'])
-                        df_temp['mois'] = df_temp['date_installation'].dt.to_period('M').astype(str)
-                        
-                        fig, ax = plt.subplots(figsize=(10, 4))
-                        df_temp['mois'].value_counts().sort_index().plot(kind='line', marker='o', ax=ax)
-                        ax.set_title('Installations par mois')
-                        st.pyplot(fig)
+                    if 'date_installation' in df_stats.columns and st.toggle("Afficher les tendances", key='show_tendances'):
+                        # Lecture seule de la colonne : pas de copie du DataFrame
+                        dates = pd.to_datetime(df_stats['date_installation'])
+                        # Clé mois entière (aaaamm) : comptage sur int32 plutôt que sur des périodes
+                        dt = dates.dropna().dt
+                        mois = (dt.year * 100 + dt.month).astype('int32')
+                        monthly = mois.value_counts().sort_index()
+                        monthly.index = pd.to_datetime(monthly.index.astype(str), format='%Y%m')
+
+                        st.image(installations_png(monthly), use_container_width=True)
                 
                 with tab3:
-                    st.dataframe(df_stats.describe(include='all', datetime_is_numeric=True))
+                    if st.toggle("Afficher les détails", key='show_details'):
+                        st.dataframe(df_stats.describe(include='all', datetime_is_numeric=True))
 
             # Étape 4: Fusion des données
             if st.session_state.converted_dfs:
@@ -141,26 +215,27 @@ def main():
                         try:
                             dfs = st.session_state.converted_dfs
                             
-                            # Fusion avec gestion des colonnes communes
-                            merged = pd.merge(
-                                dfs['installations'],
-                                dfs['incidents'],
-                                on=['modèle', 'no_serie', 'référence pays', 'filiale'],
-                                how='left',
-                                suffixes=('', '_incident')
-                            )
-                            
-                            merged = pd.merge(
-                                merged,
-                                dfs['rma'],
-                                on=['modèle', 'no_serie', 'référence pays', 'filiale'],
-                                how='left',
-                                suffixes=('', '_rma')
-                            )
-                            
-                            # Suppression des doublons de colonnes
-                            merged = merged.loc[:, ~merged.columns.duplicated()]
-                            
+                            # Fusion avec gestion des colonnes communes : une colonne de la
+                            # feuille n'est écartée que si son nom et son nom suffixé existent
+                            # déjà tous deux, le résultat n'a donc jamais de doublons à nettoyer
+                            keys = ['modèle', 'no_serie', 'référence pays', 'filiale']
+                            merged = dfs['installations']
+                            for name, suffix in [('incidents', '_incident'), ('rma', '_rma')]:
+                                right = dfs[name]
+                                right_cols = keys + [
+                                    col for col in right.columns
+                                    if col not in keys and not (
+                                        col in merged.columns and f"{col}{suffix}" in merged.columns
+                                    )
+                                ]
+                                merged = pd.merge(
+                                    merged,
+                                    right[right_cols],
+                                    on=keys,
+                                    how='left',
+                                    suffixes=('', suffix)
+                                )
+
                             st.session_state.merged_data = merged
                             st.success("Fusion terminée avec succès!")
                             
@@ -180,12 +255,17 @@ def main():
                 filename = f"donnees_produits_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
                 
                 if export_format == "Excel":
+                    # Écriture en flux (constant_memory) : les lignes sont écrites dans l'ordre
                     output = BytesIO()
-                    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                        st.session_state.merged_data.to_excel(writer, index=False)
-                        # Ajouter les stats dans un onglet séparé
-                        for name, df in st.session_state.converted_dfs.items():
-                            df.to_excel(writer, sheet_name=f"Stats_{name}", index=False)
+                    workbook = xlsxwriter.Workbook(output, {
+                        'constant_memory': True,
+                        'default_date_format': 'dd/mm/yyyy'
+                    })
+                    write_sheet(workbook, 'Sheet1', st.session_state.merged_data)
+                    # Ajouter les stats dans un onglet séparé
+                    for name, df in st.session_state.converted_dfs.items():
+                        write_sheet(workbook, f"Stats_{name}", df)
+                    workbook.close()
                     
                     st.download_button(
                         label="📥 Télécharger Excel",
@@ -194,7 +274,7 @@ def main():
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                     )
                 else:
-                    csv = st.session_state.merged_data.to_csv(index=False).encode('utf-8')
+                    csv = st.session_state.merged_data.to_csv(index=False, date_format='%d/%m/%Y').encode('utf-8')
                     st.download_button(
                         label="📥 Télécharger CSV",
                         data=csv,
@@ -0,0 +1,51 @@
+# Fonctions partagées par les applications Streamlit (lecture et export Excel, graphiques Altair)
+import streamlit as st
+import pandas as pd
+import numpy as np
+import altair as alt
+
+# Lecteur Excel en Rust (python-calamine) si disponible, moteur par défaut sinon
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
+
+def write_sheet(workbook, sheet_name, df):
+    """Écrit un DataFrame ligne par ligne (compatible avec constant_memory)"""
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(col) for col in df.columns])
+    values = df.astype(object).where(df.notna(), None)
+    for row_idx, row in enumerate(values.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_idx, 0, row)
+
+def kde_curve(data, edges, sample=5000, points=200):
+    # Densité gaussienne estimée sur un échantillon fixe, à l'échelle des effectifs
+    n = len(data)
+    if n < 2 or data.std() == 0:
+        return None
+    if n > sample:
+        data = np.random.default_rng(0).choice(data, sample, replace=False)
+    bw = data.std() * len(data) ** (-1 / 5)  # règle de Scott
+    grid = np.linspace(edges[0], edges[-1], points)
+    kernel = np.exp(-0.5 * ((grid[:, None] - data[None, :]) / bw) ** 2)
+    density = kernel.mean(axis=1) / (bw * np.sqrt(2 * np.pi))
+    return pd.DataFrame({'x': grid, 'count': density * n * (edges[1] - edges[0])})
+
+# Graphiques Altair rendus côté navigateur (pas de rastérisation matplotlib)
+@st.cache_data(show_spinner=False)
+def histogram_chart(values, bins=20):
+    # Classes précalculées avec numpy : Vega ne reçoit que les effectifs
+    data = pd.to_numeric(values, errors='coerce').dropna().to_numpy(dtype='float64')
+    counts, edges = np.histogram(data, bins=bins)
+    binned = pd.DataFrame({'début': edges[:-1], 'fin': edges[1:], 'count': counts})
+    bars = alt.Chart(binned).mark_bar().encode(
+        x=alt.X('début:Q', title=str(values.name)),
+        x2='fin:Q',
+        y=alt.Y('count:Q', title='Nombre')
+    )
+    curve = kde_curve(data, edges)
+    if curve is None:
+        return bars
+    line = alt.Chart(curve).mark_line(color='black').encode(x='x:Q', y='count:Q')
+    return alt.layer(bars, line)
@@ -1,19 +1,25 @@
 import streamlit as st
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime
+from datetime import datetime, date
 import os
 from fpdf import FPDF
 import base64
 import numpy as np
 from io import BytesIO
+import xlsxwriter
 import logging
+from common import EXCEL_ENGINE, write_sheet
 
 # Configuration de l'application
 st.set_page_config(layout="wide", page_title="Analyse Technique des Appareils")
 logging.basicConfig(level=logging.INFO)
 
+# Nombre de nanosecondes dans un mois moyen (30,44 jours)
+NS_PER_MONTH = np.float32(30.44 * 86400e9)
+
 def main():
     st.title("📊 Analyse Complète des Appareils Techniques")
     
@@ -22,8 +28,8 @@ def main():
     
     if uploaded_file is not None:
         try:
-            # Lecture du fichier
-            df = pd.read_excel(uploaded_file)
+            # Lecture du fichier (mise en cache sur le contenu)
+            df = load_excel(uploaded_file.getvalue())
             
             # Vérification des colonnes
             required_columns = [
@@ -38,18 +44,19 @@ def main():
                 return
             
             # Préparation des données
-            df = clean_and_prepare_data(df)
+            # Date du jour passée en argument : elle fait partie de la clé du cache
+            df = clean_and_prepare_data(df, date.today())
             
             # Sidebar avec filtres et commentaires
             with st.sidebar:
                 st.header("Filtres")
                 model_filter = st.selectbox(
                     "Modèle",
-                    ['Tous'] + sorted(df['modèle'].dropna().unique().tolist())
+                    ['Tous'] + df['modèle'].cat.categories.tolist())
                 
                 filiale_filter = st.selectbox(
                     "Filiale",
-                    ['Tous'] + sorted(df['filiale'].dropna().unique().tolist())
+                    ['Tous'] + df['filiale'].cat.categories.tolist())
                 
                 st.header("Commentaires")
                 global_comment = st.text_area("Commentaire général")
@@ -59,84 +66,151 @@ def main():
             # Application des filtres
             filtered_df = apply_filters(df, model_filter, filiale_filter)
             
+            # Indicateurs calculés une seule fois pour l'affichage et les exports
+            summary = summarize(filtered_df)
+            
             # Section indicateurs
-            show_key_metrics(filtered_df)
+            show_key_metrics(summary)
             
-            # Section tableau filiale
-            show_filiale_table(filtered_df)
+            # Section tableau filiale (calculé une fois, réutilisé pour le PDF)
+            filiale_table = create_filiale_table(filtered_df)
+            show_filiale_table(filiale_table)
             
             # Section visualisations
             show_visualizations(filtered_df, ttf_comment, age_comment)
             
             # Section export
-            show_export_options(filtered_df, global_comment, ttf_comment, age_comment)
+            show_export_options(filtered_df, summary, filiale_table, global_comment, ttf_comment, age_comment)
             
         except Exception as e:
             st.error(f"Erreur lors du traitement: {str(e)}")
             logging.exception("Erreur dans le traitement principal")
 
-def clean_and_prepare_data(df):
-    """Nettoie et prépare les données"""
-    # Conversion des dates
+@st.cache_data(show_spinner=False)
+def load_excel(file_bytes):
+    """Lit le fichier Excel une seule fois par contenu"""
+    return pd.read_excel(BytesIO(file_bytes), engine=EXCEL_ENGINE)
+
+def months_between(end, start):
+    """Écart en mois entre deux dates datetime64[ns] (float32, NaN si l'une manque)"""
+    valid = ~(np.isnat(end) | np.isnat(start))
+    delta = (np.asarray(end).view('i8') - np.asarray(start).view('i8')).astype('float32')
+    return np.where(valid, delta / NS_PER_MONTH, np.float32(np.nan))
+
+@st.cache_data(show_spinner=False)
+def clean_and_prepare_data(df, today):
+    """Nettoie et prépare les données (âges calculés à la date today)"""
+    # Conversion des dates : les colonnes déjà datées par Excel sont laissées telles
+    # quelles, les autres sont lues avec un format fixe avant le parseur générique
     date_cols = ['FabricationDate', 'installationDate', 'incidentDate', 'Lastconnexion']
     for col in date_cols:
-        df[col] = pd.to_datetime(df[col], errors='coerce')
+        if not pd.api.types.is_datetime64_any_dtype(df[col]):
+            parsed = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
+            remaining = parsed.isna() & df[col].notna()
+            if remaining.any():
+                parsed[remaining] = pd.to_datetime(df.loc[remaining, col], errors='coerce')
+            df[col] = parsed
     
-    # Calcul des métriques
-    today = datetime.now()
+    # Calcul des métriques sur les nanosecondes int64 des tableaux datetime64
+    # (résultats directement en float32, NaN si une date manque)
+    today = np.datetime64(today, 'ns')
+    incident = df['incidentDate'].to_numpy(dtype='datetime64[ns]')
+    installation = df['installationDate'].to_numpy(dtype='datetime64[ns]')
+    fabrication = df['FabricationDate'].to_numpy(dtype='datetime64[ns]')
     
-    # Time to Failure (en mois)
-    df['TTF_installation'] = (df['incidentDate'] - df['installationDate']).dt.days / 30.44
-    df['TTF_fabrication'] = (df['incidentDate'] - df['FabricationDate']).dt.days / 30.44
-    df['Time_to_Failure'] = df[['TTF_installation', 'TTF_fabrication']].max(axis=1)
+    # Time to Failure (en mois) : fmax ignore le NaN d'un côté, les deux
+    # intermédiaires ne sont pas conservés dans le DataFrame
+    df['Time_to_Failure'] = np.fmax(
+        months_between(incident, installation),
+        months_between(incident, fabrication)
+    )
     
     # Âges (en mois)
-    df['Age_installation'] = (today - df['installationDate']).dt.days / 30.44
-    df['Age_fabrication'] = (today - df['FabricationDate']).dt.days / 30.44
+    df['Age_installation'] = months_between(today, installation)
+    df['Age_fabrication'] = months_between(today, fabrication)
+    
+    # Colonnes de regroupement et de filtre en catégories (codes entiers)
+    for col in ('modèle', 'filiale'):
+        df[col] = df[col].astype('category')
     
     return df
 
+@st.cache_data(show_spinner=False)
 def apply_filters(df, model, filiale):
     """Applique les filtres aux données"""
-    filtered = df.copy()
+    # Aucun filtre actif : le DataFrame est renvoyé tel quel
+    if model == 'Tous' and filiale == 'Tous':
+        return df
+    
+    # Masque booléen unique, sans copie préalable du DataFrame
+    mask = np.ones(len(df), dtype=bool)
     if model != 'Tous':
-        filtered = filtered[filtered['modèle'] == model]
+        mask &= (df['modèle'] == model).to_numpy()
     if filiale != 'Tous':
-        filtered = filtered[filtered['filiale'] == filiale]
-    return filtered
+        mask &= (df['filiale'] == filiale).to_numpy()
+    return df if mask.all() else df.loc[mask]
+
+def summarize(df):
+    """Calcule les indicateurs clés en un seul passage"""
+    ttf = df['Time_to_Failure'].to_numpy()
+    valid = ~np.isnan(ttf)
+    return {
+        'n': len(df),
+        'n_inc': int(valid.sum()),
+        'ttf_max': float(ttf[valid].max()) if valid.any() else None,
+        'age_mean': float(df['Age_fabrication'].mean())
+    }
 
-def show_key_metrics(df):
+def show_key_metrics(summary):
     """Affiche les indicateurs clés"""
     st.header("🔍 Indicateurs Clés")
     cols = st.columns(4)
     
     with cols[0]:
-        st.metric("Appareils analysés", len(df))
+        st.metric("Appareils analysés", summary['n'])
         
     with cols[1]:
-        valid_ttf = df['Time_to_Failure'].notna().sum()
-        st.metric("Appareils avec incidents", valid_ttf)
+        st.metric("Appareils avec incidents", summary['n_inc'])
     
     with cols[2]:
-        if valid_ttf > 0:
-            max_ttf = df['Time_to_Failure'].max()
-            st.metric("Max Time to Failure (mois)", f"{max_ttf:.1f}")
+        if summary['ttf_max'] is not None:
+            st.metric("Max Time to Failure (mois)", f"{summary['ttf_max']:.1f}")
     
     with cols[3]:
-        avg_age = df['Age_fabrication'].mean()
-        st.metric("Âge moyen depuis fab. (mois)", f"{avg_age:.1f}")
+        st.metric("Âge moyen depuis fab. (mois)", f"{summary['age_mean']:.1f}")
+
+@st.cache_data(show_spinner=False)
+def create_filiale_table(df):
+    """Calcule le tableau de répartition par filiale"""
+    return df.groupby('filiale', observed=True, sort=False).agg(**{
+        'Nombre': ('SN', 'count'),
+        'TTF moyen (mois)': ('Time_to_Failure', 'mean'),
+        'Âge moyen (mois)': ('Age_fabrication', 'mean')
+    }).round(1).sort_values('Nombre', ascending=False)
+
+@st.cache_data(show_spinner=False)
+def histogram_bins(values, bins=20):
+    """Calcule les effectifs et bornes de l'histogramme"""
+    return np.histogram(values.to_numpy(dtype='float32'), bins=bins)
+
+def histogram_figure(values, xlabel):
+    """Dessine l'histogramme d'une série dans une nouvelle figure (propre à l'appel)"""
+    counts, edges = histogram_bins(values)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', edgecolor='white')
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("Nombre d'appareils")
+    return fig
 
-def show_filiale_table(df):
+def show_filiale_table(table):
     """Affiche le tableau de répartition par filiale"""
     st.header("📋 Répartition par Filiale")
     
-    table = df.groupby('filiale').agg(
-        Nombre=('SN', 'count'),
-        'TTF moyen (mois)'=('Time_to_Failure', 'mean'),
-        'Âge moyen (mois)'=('Age_fabrication', 'mean')
-    ).round(1).sort_values('Nombre', ascending=False)
-    
-    st.dataframe(table.style.background_gradient(cmap='Blues'), height=400)
+    # Dégradé Styler uniquement pour les petits tableaux, rendu Arrow direct sinon
+    if len(table) <= 50:
+        st.dataframe(table.style.background_gradient(cmap='Blues'), height=400)
+    else:
+        st.dataframe(table, height=400)
 
 def show_visualizations(df, ttf_comment, age_comment):
     """Affiche les graphiques"""
@@ -146,31 +220,27 @@ def show_visualizations(df, ttf_comment, age_comment):
     
     with col1:
         st.subheader("Time to Failure (mois)")
-        fig1 = plt.figure(figsize=(10, 6))
-        sns.histplot(df['Time_to_Failure'].dropna(), bins=20, kde=True)
-        plt.xlabel("Mois avant incident")
-        plt.ylabel("Nombre d'appareils")
+        fig1 = histogram_figure(df['Time_to_Failure'].dropna(), "Mois avant incident")
         st.pyplot(fig1)
+        plt.close(fig1)
         if ttf_comment:
             st.info(f"💬 {ttf_comment}")
     
     with col2:
         st.subheader("Âge depuis fabrication (mois)")
-        fig2 = plt.figure(figsize=(10, 6))
-        sns.histplot(df['Age_fabrication'].dropna(), bins=20, kde=True)
-        plt.xlabel("Âge (mois)")
-        plt.ylabel("Nombre d'appareils")
+        fig2 = histogram_figure(df['Age_fabrication'].dropna(), "Âge (mois)")
         st.pyplot(fig2)
+        plt.close(fig2)
         if age_comment:
             st.info(f"💬 {age_comment}")
 
-def show_export_options(df, global_comment, ttf_comment, age_comment):
+def show_export_options(df, summary, filiale_table, global_comment, ttf_comment, age_comment):
     """Gère l'export des données"""
     st.header("💾 Export des Résultats")
     
     # Export Excel
     st.subheader("Export Excel")
-    excel_data = export_to_excel(df, global_comment, ttf_comment, age_comment)
+    excel_data = export_to_excel(df, summary, global_comment, ttf_comment, age_comment)
     st.download_button(
         label="Télécharger Excel",
         data=excel_data,
@@ -181,7 +251,9 @@ def show_export_options(df, global_comment, ttf_comment, age_comment):
     # Export PDF
     st.subheader("Export PDF")
     if st.button("Générer le rapport PDF"):
-        pdf_report = create_pdf_report(df, global_comment, ttf_comment, age_comment)
+        # Horodatage passé en argument : il fait partie de la clé du cache
+        generated_at = datetime.now().strftime('%d/%m/%Y %H:%M')
+        pdf_report = create_pdf_report(summary, filiale_table, global_comment, ttf_comment, age_comment, generated_at)
         st.download_button(
             label="Télécharger PDF",
             data=pdf_report,
@@ -189,38 +261,46 @@ def show_export_options(df, global_comment, ttf_comment, age_comment):
             mime='application/pdf'
         )
 
-def export_to_excel(df, global_comment, ttf_comment, age_comment):
+def export_to_excel(df, summary, global_comment, ttf_comment, age_comment):
     """Exporte les données au format Excel"""
+    # Écriture en flux (constant_memory) directement en mémoire
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        # Données complètes
-        df.to_excel(writer, sheet_name='Données', index=False)
-        
-        # Statistiques
-        stats = pd.DataFrame({
-            'Métrique': ['Appareils totaux', 'Appareils avec incidents',
-                        'Time to Failure max', 'Âge moyen depuis fabrication'],
-            'Valeur': [
-                len(df),
-                df['Time_to_Failure'].notna().sum(),
-                f"{df['Time_to_Failure'].max():.1f} mois" if df['Time_to_Failure'].notna().any() else 'N/A',
-                f"{df['Age_fabrication'].mean():.1f} mois"
-            ]
-        })
-        stats.to_excel(writer, sheet_name='Statistiques', index=False)
-        
-        # Commentaires
-        comments = pd.DataFrame({
-            'Section': ['Global', 'Time to Failure', 'Âge des appareils'],
-            'Commentaire': [global_comment, ttf_comment, age_comment]
-        })
-        comments.to_excel(writer, sheet_name='Commentaires', index=False)
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy'
+    })
+    
+    # Données complètes
+    write_sheet(workbook, 'Données', df)
     
+    # Statistiques
+    stats = pd.DataFrame({
+        'Métrique': ['Appareils totaux', 'Appareils avec incidents',
+                    'Time to Failure max', 'Âge moyen depuis fabrication'],
+        'Valeur': [
+            summary['n'],
+            summary['n_inc'],
+            f"{summary['ttf_max']:.1f} mois" if summary['ttf_max'] is not None else 'N/A',
+            f"{summary['age_mean']:.1f} mois"
+        ]
+    })
+    write_sheet(workbook, 'Statistiques', stats)
+    
+    # Commentaires
+    comments = pd.DataFrame({
+        'Section': ['Global', 'Time to Failure', 'Âge des appareils'],
+        'Commentaire': [global_comment, ttf_comment, age_comment]
+    })
+    write_sheet(workbook, 'Commentaires', comments)
+    
+    workbook.close()
     return output.getvalue()
 
-def create_pdf_report(df, global_comment, ttf_comment, age_comment):
+@st.cache_data(show_spinner="Génération du rapport PDF...")
+def create_pdf_report(summary, filiale_table, global_comment, ttf_comment, age_comment, generated_at):
     """Crée un rapport PDF professionnel"""
     pdf = FPDF()
+    pdf.set_auto_page_break(True, 15)
     pdf.add_page()
     pdf.set_font("Arial", size=12)
     
@@ -228,7 +308,7 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
     pdf.set_font("Arial", 'B', 16)
     pdf.cell(200, 10, txt="Rapport d'Analyse Technique", ln=1, align='C')
     pdf.set_font("Arial", size=10)
-    pdf.cell(200, 10, txt=f"Généré le {datetime.now().strftime('%d/%m/%Y %H:%M')}", ln=1, align='C')
+    pdf.cell(200, 10, txt=f"Généré le {generated_at}", ln=1, align='C')
     pdf.ln(15)
     
     # Commentaire global
@@ -245,10 +325,10 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
     pdf.set_font("Arial", size=10)
     
     stats = [
-        f"Appareils analysés: {len(df)}",
-        f"Appareils avec incidents: {df['Time_to_Failure'].notna().sum()}",
-        f"Time to Failure max: {df['Time_to_Failure'].max():.1f} mois" if df['Time_to_Failure'].notna().any() else "Time to Failure max: N/A",
-        f"Âge moyen depuis fabrication: {df['Age_fabrication'].mean():.1f} mois"
+        f"Appareils analysés: {summary['n']}",
+        f"Appareils avec incidents: {summary['n_inc']}",
+        f"Time to Failure max: {summary['ttf_max']:.1f} mois" if summary['ttf_max'] is not None else "Time to Failure max: N/A",
+        f"Âge moyen depuis fabrication: {summary['age_mean']:.1f} mois"
     ]
     
     for stat in stats:
@@ -259,26 +339,18 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
     pdf.set_font("Arial", 'B', 14)
     pdf.cell(200, 10, txt="Répartition par Filiale", ln=1)
     
-    filiale_table = df.groupby('filiale').agg(
-        Nombre=('SN', 'count'),
-        'TTF moyen (mois)'=('Time_to_Failure', 'mean'),
-        'Âge moyen (mois)'=('Age_fabrication', 'mean')
-    ).round(1).reset_index()
-    
-    # En-têtes du tableau
-    pdf.set_font("Arial", 'B', 10)
-    col_width = [50, 30, 40, 40]
-    headers = filiale_table.columns
-    for i, header in enumerate(headers):
-        pdf.cell(col_width[i], 10, str(header), border=1)
-    pdf.ln()
-    
-    # Données du tableau
+    filiale_table = filiale_table.reset_index()
+    
+    # Tableau rendu ligne par ligne par fpdf2 (en-têtes en gras)
     pdf.set_font("Arial", size=10)
-    for _, row in filiale_table.iterrows():
-        for i, val in enumerate(row):
-            pdf.cell(col_width[i], 10, str(val), border=1)
-        pdf.ln()
+    with pdf.table(col_widths=(50, 30, 40, 40), width=160, text_align='LEFT') as table:
+        header = table.row()
+        for col in filiale_table.columns:
+            header.cell(str(col))
+        for values in filiale_table.itertuples(index=False, name=None):
+            row = table.row()
+            for val in values:
+                row.cell(str(val))
     
     pdf.ln(15)
     
@@ -299,7 +371,7 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
         pdf.set_font("Arial", size=10)
         pdf.multi_cell(0, 8, txt=age_comment)
     
-    return pdf.output(dest='S').encode('latin1')
+    return bytes(pdf.output())
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,19 @@
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime
+from datetime import datetime, date
 import numpy as np
 from fpdf import FPDF
 from io import BytesIO
+import xlsxwriter
+from common import EXCEL_ENGINE, write_sheet
 
 # Configuration de l'application
 st.set_page_config(layout="wide", page_title="Analyse Technique des Appareils")
 
+# Nombre de nanosecondes dans un mois moyen (30,44 jours)
+NS_PER_MONTH = np.float32(30.44 * 86400e9)
+
 def main():
     st.title("📊 Analyse Complète des Appareils Techniques")
     
@@ -19,7 +23,8 @@ def main():
     if uploaded_file is not None:
         try:
             df = load_and_validate_data(uploaded_file)
-            df = clean_and_prepare_data(df)
+            # Date du jour passée en argument : elle fait partie de la clé du cache
+            df = clean_and_prepare_data(df, date.today())
             
             # Affichage des données brutes
             st.header("📋 Données Brutes")
@@ -36,11 +41,13 @@ def main():
             
             # Tableau de répartition
             st.header("📊 Répartition par Filiale")
-            show_filiale_table(filtered_df)
+            filiale_table = create_filiale_table(filtered_df)
+            show_filiale_table(filiale_table)
             
             # Indicateurs
             st.header("🔍 Indicateurs Clés")
-            show_key_metrics(filtered_df)
+            summary = summarize(filtered_df)
+            show_key_metrics(summary)
             
             # Visualisations
             st.header("📈 Visualisations")
@@ -48,14 +55,19 @@ def main():
             
             # Export
             st.header("💾 Export des Résultats")
-            show_export_options(filtered_df, global_comment, ttf_comment, age_comment)
+            show_export_options(filtered_df, summary, filiale_table, global_comment, ttf_comment, age_comment)
             
         except Exception as e:
             st.error(f"Erreur: {str(e)}")
 
+@st.cache_data(show_spinner=False)
+def load_excel(file_bytes):
+    """Lit le fichier Excel une seule fois par contenu"""
+    return pd.read_excel(BytesIO(file_bytes), engine=EXCEL_ENGINE)
+
 def load_and_validate_data(uploaded_file):
     """Charge et valide les données"""
-    df = pd.read_excel(uploaded_file)
+    df = load_excel(uploaded_file.getvalue())
     required_columns = [
         'modèle', 'SN', 'FabricationDate', 'refPays', 'filiale',
         'installationDate', 'Lastconnexion', 'incident', 'incidentDate'
@@ -65,94 +77,182 @@ def load_and_validate_data(uploaded_file):
         raise ValueError(f"Colonnes manquantes: {', '.join(missing_cols)}")
     return df
 
-def clean_and_prepare_data(df):
-    """Nettoie et prépare les données"""
+def derive_months(inc, inst, fab, today):
+    """TTF et âges en mois (float32) : chaque date lue une fois, tampons réutilisés"""
+    inc_ns, inst_ns, fab_ns = inc.view('i8'), inst.view('i8'), fab.view('i8')
+    inc_nat, inst_nat, fab_nat = np.isnat(inc), np.isnat(inst), np.isnat(fab)
+    today_ns = today.astype('datetime64[ns]').view('i8')
+    delta = np.empty(len(inc), dtype='i8')
+    
+    results = []
+    for end, start, missing in [(inc_ns, inst_ns, inc_nat | inst_nat),
+                                (inc_ns, fab_ns, inc_nat | fab_nat),
+                                (today_ns, inst_ns, inst_nat),
+                                (today_ns, fab_ns, fab_nat)]:
+        np.subtract(end, start, out=delta)
+        months = delta.astype('float32')
+        months /= NS_PER_MONTH
+        months[missing] = np.nan
+        results.append(months)
+    
+    ttf_inst, ttf_fab, age_inst, age_fab = results
+    # Time to Failure selon la nouvelle règle
+    ttf = np.where(ttf_inst > 0, ttf_inst, ttf_fab)
+    return ttf, age_inst, age_fab
+
+@st.cache_data(show_spinner=False)
+def clean_and_prepare_data(df, today):
+    """Nettoie et prépare les données (âges calculés à la date today)"""
     # Conversion des dates
     date_cols = ['FabricationDate', 'installationDate', 'incidentDate', 'Lastconnexion']
     for col in date_cols:
         df[col] = pd.to_datetime(df[col], errors='coerce')
     
-    # Calcul des métriques
-    today = datetime.now()
+    # Calcul des métriques sur les nanosecondes int64 des tableaux datetime64
+    today = np.datetime64(today, 'ns')
+    inc = df['incidentDate'].to_numpy(dtype='datetime64[ns]')
+    inst = df['installationDate'].to_numpy(dtype='datetime64[ns]')
+    fab = df['FabricationDate'].to_numpy(dtype='datetime64[ns]')
     
-    # Time to Failure selon la nouvelle règle
-    ttf_inst = (df['incidentDate'] - df['installationDate']).dt.days / 30.44
-    ttf_fab = (df['incidentDate'] - df['FabricationDate']).dt.days / 30.44
-    df['Time_to_Failure'] = np.where(ttf_inst > 0, ttf_inst, ttf_fab)
+    ttf, age_inst, age_fab = derive_months(inc, inst, fab, today)
+    df['Time_to_Failure'] = ttf
     
     # Âges (en mois)
-    df['Age_installation'] = (today - df['installationDate']).dt.days / 30.44
-    df['Age_fabrication'] = (today - df['FabricationDate']).dt.days / 30.44
+    df['Age_installation'] = age_inst
+    df['Age_fabrication'] = age_fab
+    
+    # Colonnes entières réduites au plus petit type suffisant (valeurs exactes) ;
+    # les flottants du fichier gardent leur précision, seules les colonnes
+    # calculées ci-dessus sont en float32
+    for col in df.select_dtypes('int64').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    
+    # Colonnes à faible cardinalité en catégories (codes entiers)
+    for col in ('modèle', 'filiale', 'refPays'):
+        if col in df:
+            df[col] = df[col].astype('category')
     
     return df
 
 def create_filters(df):
     """Crée les widgets de filtre"""
     return (
-        st.selectbox("Modèle", ['Tous'] + sorted(df['modèle'].dropna().unique().tolist())),
-        st.selectbox("Filiale", ['Tous'] + sorted(df['filiale'].dropna().unique().tolist()))
+        st.selectbox("Modèle", ['Tous'] + df['modèle'].cat.categories.tolist()),
+        st.selectbox("Filiale", ['Tous'] + df['filiale'].cat.categories.tolist())
     )
 
+@st.cache_data(show_spinner=False)
 def apply_filters(df, model, filiale):
     """Applique les filtres"""
-    filtered = df.copy()
+    # Aucun filtre actif : le DataFrame est renvoyé tel quel
+    if model == 'Tous' and filiale == 'Tous':
+        return df
+    
+    # Masque booléen unique, sans copie préalable du DataFrame
+    mask = np.ones(len(df), dtype=bool)
     if model != 'Tous':
-        filtered = filtered[filtered['modèle'] == model]
+        mask &= df['modèle'].eq(model).to_numpy()
     if filiale != 'Tous':
-        filtered = filtered[filtered['filiale'] == filiale]
-    return filtered
+        mask &= df['filiale'].eq(filiale).to_numpy()
+    return df.loc[mask]
 
-def show_filiale_table(df):
+@st.cache_data(show_spinner=False)
+def create_filiale_table(df):
+    """Calcule le tableau de répartition par filiale (une seule agrégation)"""
+    return df.groupby('filiale', sort=False, observed=True).agg(**{
+        'Nombre': ('SN', 'count'),
+        'TTF moyen (mois)': ('Time_to_Failure', 'mean'),
+        'Âge moyen (mois)': ('Age_fabrication', 'mean')
+    }).round(1).sort_values('Nombre', ascending=False)
+
+def show_filiale_table(table):
     """Affiche le tableau de répartition par filiale"""
-    table = df.groupby('filiale').agg(
-        Nombre=('SN', 'count'),
-        **{'TTF moyen (mois)': ('Time_to_Failure', 'mean')},
-        **{'Âge moyen (mois)': ('Age_fabrication', 'mean')}
-    ).round(1).sort_values('Nombre', ascending=False)
-    
     st.dataframe(table.style.background_gradient(cmap='Blues'), height=400)
 
-def show_key_metrics(df):
+def summarize(df):
+    """Calcule les indicateurs clés en une lecture de chaque colonne"""
+    ttf = df['Time_to_Failure'].to_numpy(dtype=np.float32)
+    age = df['Age_fabrication'].to_numpy(dtype=np.float32)
+    mask = ~np.isnan(ttf)
+    n_inc = int(mask.sum())
+    return {
+        'n': len(df),
+        'n_inc': n_inc,
+        'ttf_max': float(ttf[mask].max()) if n_inc else None,
+        'age_mean': float(age[~np.isnan(age)].mean()) if age.size else float('nan')
+    }
+
+def show_key_metrics(summary):
     """Affiche les indicateurs clés"""
     cols = st.columns(4)
     metrics = [
-        ("Appareils analysés", len(df)),
-        ("Appareils avec incidents", df['Time_to_Failure'].notna().sum()),
-        ("Max TTF (mois)", df['Time_to_Failure'].max() if df['Time_to_Failure'].notna().any() else 0),
-        ("Âge moyen (mois)", df['Age_fabrication'].mean())
+        ("Appareils analysés", summary['n']),
+        ("Appareils avec incidents", summary['n_inc']),
+        ("Max TTF (mois)", summary['ttf_max'] if summary['ttf_max'] is not None else 0),
+        ("Âge moyen (mois)", summary['age_mean'])
     ]
     
     for col, (label, value) in zip(cols, metrics):
         with col:
             st.metric(label, f"{value:.1f}" if isinstance(value, float) else value)
 
+def kde_curve(values, edges, points=200):
+    """Densité par noyau gaussien sur une grille fixe, à l'échelle des effectifs"""
+    n = len(values)
+    std = values.std()
+    if n < 2 or std == 0:
+        return None
+    # Règle de Scott ; KDE binnée : les valeurs sont d'abord regroupées sur la grille
+    bw = std * n ** (-1 / 5)
+    grid_counts, grid_edges = np.histogram(values, bins=points, range=(edges[0], edges[-1]))
+    grid = (grid_edges[:-1] + grid_edges[1:]) / 2
+    kernel = np.exp(-0.5 * ((grid[:, None] - grid[None, :]) / bw) ** 2)
+    density = kernel @ grid_counts / (n * bw * np.sqrt(2 * np.pi))
+    return grid, density * n * (edges[1] - edges[0])
+
+@st.cache_data(show_spinner=False)
+def histogram_data(values):
+    """Effectifs, bornes et courbe de densité d'une série (mis en cache)"""
+    vals = values.to_numpy(dtype=np.float32)
+    counts, edges = np.histogram(vals, bins=20)
+    return counts, edges, kde_curve(vals, edges)
+
+def histogram_figure(values, title, xlabel):
+    """Construit l'histogramme d'une série dans une nouvelle figure (propre à l'appel)"""
+    counts, edges, curve = histogram_data(values)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.bar((edges[:-1] + edges[1:]) / 2, counts, width=edges[1] - edges[0], edgecolor='white')
+    if curve is not None:
+        ax.plot(*curve)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    return fig
+
 def show_visualizations(df, ttf_comment, age_comment):
     """Affiche les graphiques"""
     col1, col2 = st.columns(2)
     
     with col1:
-        fig = plt.figure(figsize=(10, 6))
-        sns.histplot(df['Time_to_Failure'].dropna(), bins=20, kde=True)
-        plt.title("Distribution du Time to Failure")
-        plt.xlabel("Mois avant incident")
+        fig = histogram_figure(df['Time_to_Failure'].dropna(),
+                               "Distribution du Time to Failure", "Mois avant incident")
         st.pyplot(fig)
+        plt.close(fig)
         if ttf_comment:
             st.info(f"💬 {ttf_comment}")
     
     with col2:
-        fig = plt.figure(figsize=(10, 6))
-        sns.histplot(df['Age_fabrication'].dropna(), bins=20, kde=True)
-        plt.title("Distribution de l'âge des appareils")
-        plt.xlabel("Âge (mois)")
+        fig = histogram_figure(df['Age_fabrication'].dropna(),
+                               "Distribution de l'âge des appareils", "Âge (mois)")
         st.pyplot(fig)
+        plt.close(fig)
         if age_comment:
             st.info(f"💬 {age_comment}")
 
-def show_export_options(df, global_comment, ttf_comment, age_comment):
+def show_export_options(df, summary, filiale_table, global_comment, ttf_comment, age_comment):
     """Gère l'export des données"""
     # Export Excel
     st.subheader("Export Excel")
-    excel_data = export_to_excel(df, global_comment, ttf_comment, age_comment)
+    excel_data = export_to_excel(df, summary, global_comment, ttf_comment, age_comment)
     st.download_button(
         label="Télécharger Excel",
         data=excel_data,
@@ -163,7 +263,7 @@ def show_export_options(df, global_comment, ttf_comment, age_comment):
     # Export PDF
     st.subheader("Export PDF")
     if st.button("Générer le rapport PDF"):
-        pdf_report = create_pdf_report(df, global_comment, ttf_comment, age_comment)
+        pdf_report = create_pdf_report(summary, filiale_table, global_comment, ttf_comment, age_comment)
         st.download_button(
             label="Télécharger PDF",
             data=pdf_report,
@@ -173,7 +273,7 @@ def show_export_options(df, global_comment, ttf_comment, age_comment):
     
     # Export PDF
     if st.button("Générer PDF"):
-        pdf_report = create_pdf_report(df, global_comment, ttf_comment, age_comment)
+        pdf_report = create_pdf_report(summary, filiale_table, global_comment, ttf_comment, age_comment)
         st.download_button(
             "Télécharger PDF",
             pdf_report,
@@ -181,25 +281,30 @@ def show_export_options(df, global_comment, ttf_comment, age_comment):
             "application/pdf"
         )
 
-def export_to_excel(df, global_comment, ttf_comment, age_comment):
+@st.cache_data(show_spinner=False)
+def export_to_excel(df, summary, global_comment, ttf_comment, age_comment):
     """Exporte en Excel"""
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Données', index=False)
-        stats = pd.DataFrame({
-            'Statistique': ['Appareils totaux', 'Appareils avec incidents',
-                          'Time to Failure max', 'Âge moyen'],
-            'Valeur': [
-                len(df),
-                df['Time_to_Failure'].notna().sum(),
-                f"{df['Time_to_Failure'].max():.1f}" if df['Time_to_Failure'].notna().any() else 'N/A',
-                f"{df['Age_fabrication'].mean():.1f}"
-            ]
-        })
-        stats.to_excel(writer, sheet_name='Statistiques', index=False)
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy'
+    })
+    write_sheet(workbook, 'Données', df)
+    stats = pd.DataFrame({
+        'Statistique': ['Appareils totaux', 'Appareils avec incidents',
+                      'Time to Failure max', 'Âge moyen'],
+        'Valeur': [
+            summary['n'],
+            summary['n_inc'],
+            f"{summary['ttf_max']:.1f}" if summary['ttf_max'] is not None else 'N/A',
+            f"{summary['age_mean']:.1f}"
+        ]
+    })
+    write_sheet(workbook, 'Statistiques', stats)
+    workbook.close()
     return output.getvalue()
 
-def create_pdf_report(df, global_comment, ttf_comment, age_comment):
+def create_pdf_report(summary, filiale_table, global_comment, ttf_comment, age_comment):
     """Crée un rapport PDF professionnel"""
     pdf = FPDF()
     pdf.add_page()
@@ -218,25 +323,20 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
     pdf.set_font("Arial", size=10)
     
     stats = [
-        f"Appareils analysés: {len(df)}",
-        f"Appareils avec incidents: {df['Time_to_Failure'].notna().sum()}",
-        f"Time to Failure max: {df['Time_to_Failure'].max():.1f} mois" if df['Time_to_Failure'].notna().any() else "Time to Failure max: N/A",
-        f"Âge moyen depuis fabrication: {df['Age_fabrication'].mean():.1f} mois"
+        f"Appareils analysés: {summary['n']}",
+        f"Appareils avec incidents: {summary['n_inc']}",
+        f"Time to Failure max: {summary['ttf_max']:.1f} mois" if summary['ttf_max'] is not None else "Time to Failure max: N/A",
+        f"Âge moyen depuis fabrication: {summary['age_mean']:.1f} mois"
     ]
     
-    for stat in stats:
-        pdf.cell(0, 8, txt=stat, ln=1)
+    pdf.multi_cell(0, 8, txt='\n'.join(stats))
     pdf.ln(10)
     
     # Tableau par filiale
     pdf.set_font("Arial", 'B', 14)
     pdf.cell(200, 10, txt="Répartition par Filiale", ln=1)
     
-    filiale_table = df.groupby('filiale').agg(
-        Nombre=('SN', 'count'),
-        **{'TTF moyen (mois)': ('Time_to_Failure', 'mean')},
-        **{'Âge moyen (mois)': ('Age_fabrication', 'mean')}
-    ).round(1).reset_index()
+    filiale_table = filiale_table.reset_index()
     
     # En-têtes du tableau
     pdf.set_font("Arial", 'B', 10)
@@ -246,11 +346,15 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
         pdf.cell(col_width[i], 10, str(header), border=1, align='C')
     pdf.ln()
     
-    # Données du tableau
+    # Données du tableau : cellules formatées une seule fois en matrice de chaînes
+    float_cols = filiale_table.select_dtypes('float').columns
+    rows = filiale_table.assign(
+        **{col: filiale_table[col].map('{:.1f}'.format) for col in float_cols}
+    ).astype(str).to_numpy()
     pdf.set_font("Arial", size=10)
-    for _, row in filiale_table.iterrows():
+    for row in rows:
         for i, val in enumerate(row):
-            pdf.cell(col_width[i], 10, str(val), border=1)
+            pdf.cell(col_width[i], 10, val, border=1)
         pdf.ln()
     
     # Commentaires
@@ -278,7 +382,7 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
             pdf.multi_cell(0, 8, txt=age_comment)
     
     # Retourne directement les bytes sans ré-encoder
-    return pdf.output(dest='S')
+    return bytes(pdf.output())
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,19 @@
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
+from io import BytesIO
+
+# Lecteur Excel en Rust (python-calamine) si disponible, moteur par défaut sinon
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
+
+@st.cache_data(show_spinner=False)
+def load_excel(file_bytes):
+    # Lecture mise en cache sur le contenu du fichier
+    return pd.read_excel(BytesIO(file_bytes), engine=EXCEL_ENGINE)
 
 def main():
     st.title("Analyse des appareils")
@@ -10,7 +23,7 @@ def main():
     
     if uploaded_file:
         # Lecture et prétraitement
-        df = pd.read_excel(uploaded_file)
+        df = load_excel(uploaded_file.getvalue())
         
         # Section prétraitement
         st.header("Prétraitement des données")
@@ -22,8 +35,8 @@ def main():
             df[f'{col}_formaté'] = df[col].dt.strftime('%d/%m/%Y')
         
         # Validation SN
-        df['SN_année'] = df['SN'].str[2:4].astype(int) + 2000
-        df['SN_valide'] = (df['SN_année'] >= 2017) & (df['SN_année'] <= 2030)
+        df['SN_année'] = pd.to_numeric(df['SN'].astype(str).str[2:4], errors='coerce').astype('Int64') + 2000
+        df['SN_valide'] = df['SN_année'].between(2017, 2030).fillna(False).astype(bool)
         
         st.write("Données après prétraitement:", df)
         
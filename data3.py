@@ -6,6 +6,15 @@ import seaborn as sns
 import pycountry
 from datetime import datetime
 import plotly.express as px
+import plotly.graph_objects as go
+from io import BytesIO
+
+# Lecteur Excel en Rust (python-calamine) si disponible, moteur par défaut sinon
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
 
 # Configuration de la page
 st.set_page_config(
@@ -15,24 +24,18 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Fonctions utilitaires
-def validate_sn(sn):
-    try:
-        if pd.isna(sn) or len(str(sn)) < 4:
-            return False
-        mm = int(str(sn)[:2])
-        aa = int(str(sn)[2:4])
-        return (17 <= aa <= 30) and (1 <= mm <= 12)
-    except:
-        return False
+# Table code numérique ISO -> nom du pays, construite une seule fois
+COUNTRY_NAMES = {int(c.numeric): c.name for c in pycountry.countries if getattr(c, 'numeric', None)}
 
-def get_country_name(code):
-    try:
-        return pycountry.countries.get(numeric=str(int(code))).name
-    except:
-        return f"Inconnu ({code})"
+@st.cache_data(show_spinner=False)
+def load_data(file_bytes, name):
+    # Lecture mise en cache sur le contenu et le nom du fichier
+    if name.endswith('.xlsx'):
+        return pd.read_excel(BytesIO(file_bytes), engine=EXCEL_ENGINE)
+    return pd.read_csv(BytesIO(file_bytes))
 
 # Prétraitement des données
+@st.cache_data(show_spinner=False)
 def preprocess_data(df):
     # Vérification des colonnes nécessaires
     required_columns = ['modèle', 'SN', 'référence de pays', 
@@ -51,19 +54,39 @@ def preprocess_data(df):
             df[col] = pd.to_datetime(df[col], errors='coerce')
         
         # Extraction info SN
-        df['SN_mois'] = df['SN'].astype(str).str[:2].astype(int)
-        df['SN_année'] = 2000 + df['SN'].astype(str).str[2:4].astype(int)
-        df['SN_valide'] = df['SN'].apply(validate_sn)
+        # Mois et année lus une seule fois, puis réutilisés pour la validation
+        sn = df['SN'].astype(str)
+        head = sn.str.slice(0, 4)
+        mm = pd.to_numeric(head.str.slice(0, 2), errors='coerce').astype('Int16')
+        aa = pd.to_numeric(head.str.slice(2, 4), errors='coerce').astype('Int16')
+        df['SN_mois'] = mm
+        df['SN_année'] = 2000 + aa
+        df['SN_valide'] = (aa.between(17, 30) & mm.between(1, 12)).fillna(False).astype(bool) & sn.str.len().ge(4)
         
         # Calcul durée de vie
         df['durée_vie'] = (df['date de désinstallation'] - df['installationDate']).dt.days
-        df['jours_sans_connexion'] = (pd.to_datetime('today') - df['dernière connexion']).dt.days
+        df['jours_sans_connexion'] = (pd.Timestamp.now() - df['dernière connexion']).dt.days
         
         # Nettoyage modèle
         df['modèle_clean'] = df['modèle'].astype(str).str.lower().str.strip()
         
         # Nom du pays
-        df['pays_nom'] = df['référence de pays'].apply(get_country_name)
+        codes = pd.to_numeric(df['référence de pays'], errors='coerce')
+        codes = codes.where(codes.mod(1).eq(0)).astype('Int64')
+        df['pays_nom'] = codes.map(COUNTRY_NAMES).fillna(
+            "Inconnu (" + df['référence de pays'].astype(str) + ")"
+        )
+        
+        # Durées calculées (jours entiers) réduites en float32 ; les flottants du
+        # fichier gardent leur précision, les entiers passent au plus petit type exact
+        for col in ('durée_vie', 'jours_sans_connexion'):
+            df[col] = pd.to_numeric(df[col], downcast='float')
+        for col in df.select_dtypes('int64').columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        
+        # Colonnes à faible cardinalité en catégories (codes entiers)
+        for col in ('modèle', 'modèle_clean', 'pays_nom'):
+            df[col] = df[col].astype('category')
         
         return df
     
@@ -71,6 +94,79 @@ def preprocess_data(df):
         st.error(f"Erreur lors du prétraitement: {str(e)}")
         return None
 
+# Figures Plotly mises en cache : reconstruites seulement si le filtre change
+@st.cache_data(show_spinner=False)
+def distribution_figures(df):
+    # Agrégation côté pandas : Plotly ne reçoit que k catégories au lieu de N lignes
+    vc = df['modèle_clean'].value_counts()
+    vc = vc[vc > 0]
+    pie = px.pie(values=vc.values, names=vc.index, title='Répartition des modèles')
+    validity = df['SN_valide'].value_counts()
+    bar = px.bar(x=validity.index, y=validity.values, 
+                 labels={'x': 'SN Valide', 'y': 'Count'},
+                 title='Validité des Numéros de Série')
+    return pie, bar
+
+@st.cache_data(show_spinner=False)
+def temporal_figures(df):
+    mois = df['installationDate'].dt.to_period('M').astype(str).rename('année_mois_installation')
+    monthly = df.groupby(mois, sort=False, observed=True).size().sort_index().reset_index(name='count')
+    line = px.line(monthly, x='année_mois_installation', y='count', 
+                   title='Installations par Mois')
+    # Boîtes précalculées par modèle, lues comme px.box : moustaches aux valeurs
+    # extrêmes dans 1,5 × IQR (Tukey), points au-delà tracés comme valeurs aberrantes
+    stats = box_stats(df, 'modèle_clean', 'durée_vie')
+    color = px.colors.qualitative.Plotly[0]
+    box = go.Figure(go.Box(
+        x=stats['modèle_clean'], q1=stats['q1'], median=stats['median'], q3=stats['q3'],
+        lowerfence=stats['lowerfence'], upperfence=stats['upperfence'],
+        marker_color=color, name='durée_vie', showlegend=False
+    ))
+    outliers = stats[['modèle_clean', 'outliers']].explode('outliers').dropna()
+    if len(outliers):
+        box.add_trace(go.Scatter(
+            x=outliers['modèle_clean'], y=outliers['outliers'].astype(float),
+            mode='markers', marker_color=color, name='durée_vie', showlegend=False
+        ))
+    box.update_layout(title='Durée de Vie par Modèle',
+                      xaxis_title='modèle_clean', yaxis_title='durée_vie')
+    return line, box
+
+def box_stats(df, by, col):
+    # Quartiles, bornes de Tukey et valeurs aberrantes de col pour chaque groupe
+    rows = []
+    for name, values in df.groupby(by, sort=False, observed=True)[col]:
+        values = values.dropna().to_numpy(dtype='float64')
+        if len(values) == 0:
+            continue
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        iqr = q3 - q1
+        inside = (values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)
+        rows.append({
+            by: str(name), 'q1': q1, 'median': median, 'q3': q3,
+            'lowerfence': values[inside].min(), 'upperfence': values[inside].max(),
+            'outliers': values[~inside].tolist()
+        })
+    return pd.DataFrame(rows, columns=[by, 'q1', 'median', 'q3', 'lowerfence', 'upperfence', 'outliers'])
+
+@st.cache_data(show_spinner=False)
+def geo_figure(df):
+    country_counts = df['pays_nom'].value_counts()
+    country_counts = country_counts[country_counts > 0].reset_index()
+    country_counts.columns = ['Pays', 'Nombre d\'appareils']
+    return px.choropleth(country_counts,
+                         locations='Pays',
+                         locationmode='country names',
+                         color='Nombre d\'appareils',
+                         title='Répartition Géographique des Appareils')
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df):
+    # CSV sérialisé une seule fois par jeu de données filtré
+    buf = BytesIO()
+    df.to_csv(buf, index=False, encoding='utf-8')
+    return buf.getvalue()
+
 # Interface principale
 def main():
     st.title("📊 Analyse des Données d'Appareils")
@@ -83,10 +179,7 @@ def main():
     if uploaded_file:
         try:
             # Lecture des données
-            if uploaded_file.name.endswith('.xlsx'):
-                df = pd.read_excel(uploaded_file)
-            else:
-                df = pd.read_csv(uploaded_file)
+            df = load_data(uploaded_file.getvalue(), uploaded_file.name)
             
             # Afficher un aperçu des données brutes
             with st.expander("Aperçu des données brutes"):
@@ -104,8 +197,8 @@ def main():
                 st.header("Filtres")
                 
                 # Date range filter
-                min_date = pd.to_datetime(df_processed['installationDate'].min()).date()
-                max_date = pd.to_datetime(df_processed['installationDate'].max()).date()
+                min_date = df_processed['installationDate'].min().date()
+                max_date = df_processed['installationDate'].max().date()
                 
                 date_range = st.date_input(
                     "Période d'installation",
@@ -114,8 +207,8 @@ def main():
                     max_value=max_date
                 )
                 
-                # Model filter
-                available_models = df_processed['modèle_clean'].unique()
+                # Model filter (catégories déjà uniques et triées, même liste pour options et défaut)
+                available_models = df_processed['modèle_clean'].cat.categories.tolist()
                 selected_models = st.multiselect(
                     "Modèles à inclure",
                     options=available_models,
@@ -128,23 +221,21 @@ def main():
                     options=["Tous", "Valides seulement", "Invalides seulement"]
                 )
             
-            # Apply filters
+            # Apply filters : un seul masque booléen, sans copie du DataFrame
+            mask = np.ones(len(df_processed), dtype=bool)
             if len(date_range) == 2:
-                start_date, end_date = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
-                df_filtered = df_processed[
-                    (df_processed['installationDate'] >= start_date) & 
-                    (df_processed['installationDate'] <= end_date)
-                ]
-            else:
-                df_filtered = df_processed.copy()
+                start_date, end_date = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+                mask &= df_processed['installationDate'].between(start_date, end_date).to_numpy()
             
             if selected_models:
-                df_filtered = df_filtered[df_filtered['modèle_clean'].isin(selected_models)]
+                mask &= df_processed['modèle_clean'].isin(selected_models).to_numpy()
             
             if sn_validity == "Valides seulement":
-                df_filtered = df_filtered[df_filtered['SN_valide']]
+                mask &= df_processed['SN_valide'].to_numpy()
             elif sn_validity == "Invalides seulement":
-                df_filtered = df_filtered[~df_filtered['SN_valide']]
+                mask &= ~df_processed['SN_valide'].to_numpy()
+            
+            df_filtered = df_processed if mask.all() else df_processed[mask]
             
             # Section Statistiques
             st.header("📈 Statistiques Globales")
@@ -162,47 +253,17 @@ def main():
             tab1, tab2, tab3 = st.tabs(["Distribution", "Temporel", "Géographique"])
             
             with tab1:
-                st.plotly_chart(
-                    px.pie(df_filtered, names='modèle_clean', title='Répartition des modèles'),
-                    use_container_width=True
-                )
-                
-                st.plotly_chart(
-                    px.bar(df_filtered['SN_valide'].value_counts().reset_index(), 
-                          x='index', y='SN_valide', 
-                          labels={'index': 'SN Valide', 'SN_valide': 'Count'},
-                          title='Validité des Numéros de Série'),
-                    use_container_width=True
-                )
+                pie, bar = distribution_figures(df_filtered)
+                st.plotly_chart(pie, use_container_width=True)
+                st.plotly_chart(bar, use_container_width=True)
             
             with tab2:
-                df_filtered['année_mois_installation'] = df_filtered['installationDate'].dt.to_period('M').astype(str)
-                monthly = df_filtered.groupby('année_mois_installation').size().reset_index(name='count')
-                
-                st.plotly_chart(
-                    px.line(monthly, x='année_mois_installation', y='count', 
-                          title='Installations par Mois'),
-                    use_container_width=True
-                )
-                
-                st.plotly_chart(
-                    px.box(df_filtered, x='modèle_clean', y='durée_vie', 
-                         title='Durée de Vie par Modèle'),
-                    use_container_width=True
-                )
+                line, box = temporal_figures(df_filtered)
+                st.plotly_chart(line, use_container_width=True)
+                st.plotly_chart(box, use_container_width=True)
             
             with tab3:
-                country_counts = df_filtered['pays_nom'].value_counts().reset_index()
-                country_counts.columns = ['Pays', 'Nombre d\'appareils']
-                
-                st.plotly_chart(
-                    px.choropleth(country_counts,
-                                locations='Pays',
-                                locationmode='country names',
-                                color='Nombre d\'appareils',
-                                title='Répartition Géographique des Appareils'),
-                    use_container_width=True
-                )
+                st.plotly_chart(geo_figure(df_filtered), use_container_width=True)
             
             # Section Données
             st.header("🔍 Données Traitées")
@@ -211,7 +272,7 @@ def main():
             # Téléchargement
             st.download_button(
                 label="Télécharger les données traitées",
-                data=df_filtered.to_csv(index=False).encode('utf-8'),
+                data=to_csv_bytes(df_filtered),
                 file_name='donnees_traitees.csv',
                 mime='text/csv'
             )
@@ -0,0 +1,233 @@
+# Fonctions partagées par les applications d'analyse des incidents (CCC.py, indicent.py)
+import streamlit as st
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+import seaborn as sns
+import altair as alt
+from common import EXCEL_ENGINE, histogram_chart
+
+def read_incidents(uploaded_file):
+    # Feuille des incidents, lue avec le moteur le plus rapide disponible
+    return pd.read_excel(uploaded_file, sheet_name='Feuil8', engine=EXCEL_ENGINE)
+
+def add_incident_period(df, dates, year_col, month_col):
+    # Année et mois d'incident calculés une fois au chargement
+    df[year_col] = dates.dt.year.astype('Int16')
+    df[month_col] = dates.to_numpy().astype('datetime64[M]').astype(str)
+    df[month_col] = df[month_col].astype('category')
+
+def optimize_dtypes(df, derived=()):
+    # Seules les durées calculées (jours entiers) passent en float32 : les
+    # flottants du fichier gardent leur précision pour describe() et les moyennes
+    for col in derived:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='float')
+    for col in df.select_dtypes('int64').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    
+    # Colonnes de filtre en catégories : isin et groupby travaillent sur les codes entiers
+    for col in ['modèle', 'filiale', 'incident']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+# Tableaux de statistiques calculés une fois par état des filtres
+@st.cache_data(show_spinner=False)
+def describe_tables(df):
+    tables = {}
+    # Colonnes numériques standard
+    num_cols = df.select_dtypes(include=[np.number]).columns
+    if len(num_cols) > 0:
+        tables['num'] = df[num_cols].describe()
+    # Colonnes datetime
+    date_cols = df.select_dtypes(include=['datetime']).columns
+    if len(date_cols) > 0:
+        tables['date'] = df[date_cols].agg(['min', 'max', 'count'])
+    # Colonnes catégorielles
+    cat_cols = df.select_dtypes(include=['object', 'category']).columns
+    if len(cat_cols) > 0:
+        tables['cat'] = df[cat_cols].describe(include='all')
+    return tables
+
+# Fonction améliorée pour les statistiques descriptives
+def safe_describe(df):
+    try:
+        tables = describe_tables(df)
+        if 'num' in tables:
+            st.write("### Statistiques numériques")
+            st.dataframe(tables['num'])
+        if 'date' in tables:
+            st.write("### Statistiques des dates")
+            st.dataframe(tables['date'])
+        if 'cat' in tables:
+            st.write("### Statistiques catégorielles")
+            st.dataframe(tables['cat'])
+    except Exception as e:
+        st.warning(f"Impossible d'afficher toutes les statistiques: {str(e)}")
+
+def nonzero(counts):
+    # Les comptages sur catégories incluent les modalités filtrées (compte nul)
+    return counts[counts > 0]
+
+def pair_counts(filiale, modele):
+    # Comptage des couples (filiale, modèle) par np.bincount sur les codes catégoriels
+    f = filiale.cat.codes.to_numpy()
+    m = modele.cat.codes.to_numpy()
+    nm = len(modele.cat.categories)
+    valid = (f >= 0) & (m >= 0)  # code -1 : valeur manquante, exclue comme dans groupby
+    key = f[valid].astype(np.int64) * nm + m[valid]
+    counts = np.bincount(key, minlength=len(filiale.cat.categories) * nm)
+    nz = np.flatnonzero(counts)
+    return pd.DataFrame({
+        'filiale': filiale.cat.categories[nz // nm] if nm else [],
+        'modèle': modele.cat.categories[nz % nm] if nm else [],
+        'counts': counts[nz]
+    })
+
+# Agrégats calculés une seule fois par état des filtres, partagés par les onglets
+@st.cache_data(show_spinner=False)
+def aggregates(df):
+    agg = {}
+    if 'modèle' in df.columns:
+        agg['model_counts'] = nonzero(df['modèle'].value_counts())
+    if 'filiale' in df.columns:
+        agg['filiale_counts'] = nonzero(df['filiale'].value_counts(sort=False))
+    if 'modèle' in df.columns and 'filiale' in df.columns:
+        agg['model_by_filiale'] = pair_counts(df['filiale'], df['modèle'])
+    return agg
+
+@st.cache_data(show_spinner=False)
+def bar_chart(counts, label):
+    data = counts.rename_axis(label).reset_index(name='count')
+    return alt.Chart(data).mark_bar().encode(
+        x=alt.X('count:Q', title='Nombre'),
+        y=alt.Y(f'{label}:N', sort='-x')
+    )
+
+def multiselect_filter(df, col, label):
+    options = df[col].unique()
+    selected = st.sidebar.multiselect(label, options=options, default=options)
+    # Sélection complète (cas par défaut) : pas de masque ni de copie
+    if len(selected) < len(options):
+        df = df[df[col].isin(selected)]
+    return df
+
+def render_incident_tabs(df, cols, zone):
+    # Onglets d'analyse ; cols associe chaque rôle au nom de colonne de l'application,
+    # zone est le libellé affiché pour la filiale ('pays' ou 'filiale')
+    agg = aggregates(df)
+    
+    # Onglets pour différentes analyses
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+        "📈 Distribution", 
+        "🔄 Time to Failure", 
+        "🌍 Par Pays", 
+        "📅 Analyse Temporelle", 
+        "🔍 Détails"
+    ])
+    
+    with tab1:
+        st.subheader("Distribution des données")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if 'modèle' in df.columns:
+                st.write("### Répartition par modèle")
+                model_counts = agg['model_counts']
+                fig, ax = plt.subplots()
+                ax.pie(model_counts, labels=model_counts.index, autopct='%1.1f%%')
+                st.pyplot(fig)
+        
+        with col2:
+            if 'filiale' in df.columns:
+                st.write(f"### Répartition par {zone}")
+                filiale_counts = agg['filiale_counts'].nlargest(10)
+                st.altair_chart(bar_chart(filiale_counts, 'filiale'), use_container_width=True)
+        
+        if cols['ref_pays'] in df.columns:
+            st.write("### Distribution des références pays")
+            st.altair_chart(histogram_chart(df[cols['ref_pays']]), use_container_width=True)
+    
+    with tab2:
+        st.subheader("Analyse du Time to Failure")
+        
+        if cols['ttf'] in df.columns:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write("### Distribution du TTF")
+                st.altair_chart(histogram_chart(df[cols['ttf']]), use_container_width=True)
+            
+            with col2:
+                if 'modèle' in df.columns:
+                    st.write("### TTF par modèle")
+                    fig, ax = plt.subplots()
+                    sns.boxplot(x='modèle', y=cols['ttf'], data=df, order=agg['model_counts'].index, ax=ax)
+                    plt.xticks(rotation=45)
+                    st.pyplot(fig)
+        
+        if cols['age_installation'] in df.columns:
+            st.write("### Âge depuis l'installation lors de l'incident")
+            st.altair_chart(histogram_chart(df[cols['age_installation']]), use_container_width=True)
+    
+    with tab3:
+        st.subheader(f"Analyse par {zone}")
+        
+        if 'filiale' in df.columns:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write(f"### Incidents par {zone}")
+                incident_by_filiale = agg['filiale_counts'].nlargest(15)
+                st.altair_chart(bar_chart(incident_by_filiale, 'filiale'), use_container_width=True)
+            
+            with col2:
+                if 'modèle' in df.columns:
+                    st.write(f"### Modèles les plus défaillants par {zone}")
+                    top_models_by_filiale = agg['model_by_filiale'].nlargest(15, 'counts')
+                    st.altair_chart(alt.Chart(top_models_by_filiale).mark_bar().encode(
+                        x='counts:Q', y='filiale:N', color='modèle:N'
+                    ), use_container_width=True)
+    
+    with tab4:
+        st.subheader("Analyse temporelle")
+        
+        if cols['annee'] in df.columns:
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write("### Incidents par année")
+                incidents_by_year = df[cols['annee']].value_counts(sort=False).sort_index()
+                fig, ax = plt.subplots()
+                sns.lineplot(x=incidents_by_year.index, y=incidents_by_year.values, ax=ax)
+                st.pyplot(fig)
+            
+            with col2:
+                st.write("### Incidents par mois")
+                incidents_by_month = nonzero(df[cols['mois']].value_counts(sort=False)).sort_index().head(24)
+                fig, ax = plt.subplots(figsize=(12, 6))
+                sns.lineplot(x=incidents_by_month.index, y=incidents_by_month.values, ax=ax)
+                plt.xticks(rotation=45)
+                st.pyplot(fig)
+        
+        if cols['fab_installation'] in df.columns:
+            st.write("### Durée entre fabrication et installation")
+            st.altair_chart(histogram_chart(df[cols['fab_installation']]), use_container_width=True)
+    
+    with tab5:
+        st.subheader("Détails des incidents")
+        
+        if 'incident' in df.columns:
+            st.write("### Top 20 des incidents les plus fréquents")
+            top_incidents = nonzero(df['incident'].value_counts(sort=False)).nlargest(20)
+            st.dataframe(top_incidents)
+            
+            if 'modèle' in df.columns:
+                selected_incident = st.selectbox(
+                    "Sélectionnez un incident pour voir les modèles concernés",
+                    options=top_incidents.index
+                )
+                
+                if selected_incident:
+                    st.write(f"### Modèles pour l'incident {selected_incident}")
+                    models_for_incident = nonzero(df[df['incident'] == selected_incident]['modèle'].value_counts())
+                    st.altair_chart(bar_chart(models_for_incident, 'modèle'), use_container_width=True)
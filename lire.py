@@ -2,27 +2,57 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 import numpy as np
+from io import BytesIO
+import hashlib
+
+# Lecteur Excel en Rust (python-calamine) si disponible, moteur par défaut sinon
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
 
 st.title("Analyse de fichiers Excel")
 
-# Fonction pour charger le fichier Excel
-@st.cache_data
-def load_excel(file):
-    xls = pd.ExcelFile(file)
-    sheets = xls.sheet_names
-    dfs = {sheet: xls.parse(sheet) for sheet in sheets}
-    return dfs, sheets
+# Opérations binaires proposées pour les colonnes de calcul
+OPERATIONS = {
+    "Somme": np.add,
+    "Différence": np.subtract,
+    "Produit": np.multiply,
+    "Ratio": np.true_divide,
+}
+
+# Chargement paresseux : seule la feuille affichée est analysée (cache sur le contenu)
+@st.cache_data(show_spinner=False)
+def list_sheets(file_bytes):
+    return pd.ExcelFile(BytesIO(file_bytes), engine=EXCEL_ENGINE).sheet_names
+
+@st.cache_data(show_spinner=False)
+def load_sheet(file_bytes, sheet_name):
+    return pd.read_excel(BytesIO(file_bytes), sheet_name=sheet_name, engine=EXCEL_ENGINE)
+
+# Détection des colonnes date sur un échantillon, une fois par feuille
+@st.cache_data(show_spinner=False)
+def detect_date_cols(df, sample=200):
+    out = []
+    for col in df.select_dtypes('object').columns:
+        s = df[col].dropna().head(sample)
+        parsed = pd.to_datetime(s, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        if len(s) and parsed.notna().mean() > 0.9:
+            out.append(col)
+    return out
 
 # Upload du fichier
 uploaded_file = st.file_uploader("Choisissez un fichier Excel", type=['xlsx', 'xls'])
 
 if uploaded_file is not None:
     # Charger les données
-    dfs, sheets = load_excel(uploaded_file)
+    file_bytes = uploaded_file.getvalue()
+    sheets = list_sheets(file_bytes)
     
     # Sélection de la feuille
     selected_sheet = st.selectbox("Sélectionnez une feuille", sheets)
-    df = dfs[selected_sheet].copy()
+    df = load_sheet(file_bytes, selected_sheet)
     
     st.success(f"Feuille '{selected_sheet}' chargée avec succès!")
     
@@ -44,13 +74,13 @@ if uploaded_file is not None:
     
     # Calcul des valeurs nulles
     st.subheader("Valeurs nulles par colonne")
-    null_counts = df.isnull().sum()
+    # Comptage des non-nuls par colonne, sans matrice booléenne complète
+    null_counts = len(df) - df.count()
     st.write(null_counts)
     
     # Conversion de format de date
     st.subheader("Conversion de format de date")
-    date_columns = [col for col in df.columns if df[col].dtype == 'object' and 
-                   df[col].str.contains(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}').any()]
+    date_columns = detect_date_cols(df)
     
     if date_columns:
         selected_date_col = st.selectbox(
@@ -60,7 +90,13 @@ if uploaded_file is not None:
         
         if st.button("Convertir en JJ/MM/AAAA"):
             try:
-                df[selected_date_col] = pd.to_datetime(df[selected_date_col]).dt.strftime('%d/%m/%Y')
+                # Format connu analysé par le parseur C, parseur générique pour le reste
+                raw = df[selected_date_col]
+                parsed = pd.to_datetime(raw, format='%Y-%m-%d %H:%M:%S', errors='coerce', cache=True)
+                remaining = parsed.isna() & raw.notna()
+                if remaining.any():
+                    parsed[remaining] = pd.to_datetime(raw[remaining])
+                df[selected_date_col] = parsed.dt.strftime('%d/%m/%Y')
                 st.success(f"Colonne '{selected_date_col}' convertie avec succès!")
                 st.write(df[[selected_date_col]].head())
             except Exception as e:
@@ -97,16 +133,15 @@ if uploaded_file is not None:
             if st.button("Ajouter la colonne"):
                 if new_col_name:
                     try:
-                        if operation == "Somme":
-                            df[new_col_name] = df[first_col] + df[second_col]
-                        elif operation == "Moyenne":
-                            df[new_col_name] = (df[first_col] + df[second_col]) / 2
-                        elif operation == "Différence":
-                            df[new_col_name] = df[first_col] - df[second_col]
-                        elif operation == "Produit":
-                            df[new_col_name] = df[first_col] * df[second_col]
-                        elif operation == "Ratio":
-                            df[new_col_name] = df[first_col] / df[second_col]
+                        # Calcul direct sur les tableaux numpy (colonnes d'une même feuille, sans alignement d'index)
+                        a = df[first_col].to_numpy(dtype='float64', na_value=np.nan)
+                        b = df[second_col].to_numpy(dtype='float64', na_value=np.nan)
+                        with np.errstate(divide='ignore', invalid='ignore'):
+                            if operation == "Moyenne":
+                                result = (a + b) * 0.5
+                            else:
+                                result = OPERATIONS[operation](a, b)
+                        df[new_col_name] = result
                         
                         st.success(f"Colonne '{new_col_name}' ajoutée avec succès!")
                         st.write(df[[first_col, second_col, new_col_name]].head())
@@ -120,20 +155,25 @@ if uploaded_file is not None:
     # Télécharger le fichier modifié
     st.subheader("Télécharger les modifications")
     if st.button("Préparer le fichier pour téléchargement"):
-        output = pd.ExcelWriter('fichier_modifie.xlsx', engine='xlsxwriter')
-        for sheet in sheets:
-            if sheet == selected_sheet:
-                df.to_excel(output, sheet_name=sheet, index=False)
-            else:
-                dfs[sheet].to_excel(output, sheet_name=sheet, index=False)
-        output.close()
+        # Classeur écrit en mémoire ; resérialisé seulement si le fichier ou la feuille
+        # a changé. Seul le dernier export est conservé dans la session
+        key = (hashlib.sha1(file_bytes).hexdigest(), selected_sheet, tuple(df.columns),
+               int(pd.util.hash_pandas_object(df, index=False).sum()))
+        export = st.session_state.get('export')
+        if export is None or export[0] != key:
+            buf = BytesIO()
+            with pd.ExcelWriter(buf, engine='xlsxwriter') as output:
+                for sheet in sheets:
+                    sheet_df = df if sheet == selected_sheet else load_sheet(file_bytes, sheet)
+                    sheet_df.to_excel(output, sheet_name=sheet, index=False)
+            export = (key, buf.getvalue())
+            st.session_state['export'] = export
         
-        with open('fichier_modifie.xlsx', 'rb') as f:
-            st.download_button(
-                label="Télécharger le fichier Excel modifié",
-                data=f,
-                file_name='fichier_modifie.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
+        st.download_button(
+            label="Télécharger le fichier Excel modifié",
+            data=export[1],
+            file_name='fichier_modifie.xlsx',
+            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
 else:
     st.info("Veuillez charger un fichier Excel pour commencer.")
@@ -1,9 +1,8 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime
+import altair as alt
+from io import BytesIO
 
 # Configuration de la page
 st.set_page_config(page_title="Analyse des Réclamations", page_icon="📊", layout="wide")
@@ -11,56 +10,103 @@ st.set_page_config(page_title="Analyse des Réclamations", page_icon="📊", lay
 # Titre de l'application
 st.title("📊 Analyse des Données de Réclamation")
 
+# Colonnes de date attendues
+DATE_COLS = ['Date de fabrication', 'Date d\'installation', 'Date de réclamation', 'Date d\'analyse']
+
+# Lecture mise en cache sur le contenu du fichier
+@st.cache_data(show_spinner=False)
+def load_file(data):
+    # Numéro de série lu comme texte (format mmaaxxx, zéros de tête conservés)
+    # et dates converties dès la lecture
+    df = pd.read_excel(BytesIO(data), dtype={'Numéro de série': str})
+    for col in DATE_COLS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    
+    # Colonnes texte : chaînes Arrow pour le numéro de série, catégories pour les libellés
+    if 'Numéro de série' in df.columns:
+        df['Numéro de série'] = df['Numéro de série'].astype('string[pyarrow]')
+    for col in ('Produit', 'Panne', 'Catégorie'):
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+# TTF en jours (réclamation - installation, à défaut fabrication), mis en cache
+@st.cache_data(show_spinner=False)
+def compute_ttf(df):
+    if 'Date de réclamation' not in df.columns:
+        return None
+    for start in ('Date d\'installation', 'Date de fabrication'):
+        if start in df.columns:
+            # Soustraction sur les tableaux numpy, jours entiers par défaut (NaT -> NaN)
+            delta = df['Date de réclamation'].to_numpy() - df[start].to_numpy()
+            return pd.Series(np.floor(delta / np.timedelta64(1, 'D')), index=df.index)
+    return None
+
+# Histogramme du TTF : classes calculées avec numpy, rendu Vega-Lite côté navigateur
+@st.cache_data(show_spinner=False)
+def ttf_histogram(ttf, bins=20):
+    counts, edges = np.histogram(ttf.dropna().to_numpy(dtype='float64'), bins=bins)
+    binned = pd.DataFrame({'début': edges[:-1], 'fin': edges[1:], 'count': counts})
+    return alt.Chart(binned, title="Distribution du TTF (jours)").mark_bar().encode(
+        x=alt.X('début:Q', title='TTF (jours)'),
+        x2='fin:Q',
+        y=alt.Y('count:Q', title='Nombre')
+    )
+
+# Export Excel en mémoire, mis en cache sur le contenu du DataFrame
+@st.cache_data(show_spinner=False)
+def to_xlsx_bytes(df):
+    buf = BytesIO()
+    with pd.ExcelWriter(buf, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False)
+    return buf.getvalue()
+
 # Téléchargement du fichier Excel
 uploaded_file = st.file_uploader("Téléchargez votre fichier Excel", type=["xlsx", "xls"])
 
 if uploaded_file is not None:
     try:
         # Lecture du fichier Excel
-        df = pd.read_excel(uploaded_file)
+        df = load_file(uploaded_file.getvalue())
         
         # Afficher les premières lignes
         st.subheader("Aperçu des Données")
         st.write(df.head())
         
         # Vérification des colonnes de date
-        date_cols = ['Date de fabrication', 'Date d\'installation', 'Date de réclamation', 'Date d\'analyse']
-        date_cols_present = [col for col in date_cols if col in df.columns]
+        date_cols_present = [col for col in DATE_COLS if col in df.columns]
         
         if not date_cols_present:
             st.error("Aucune colonne de date trouvée dans le fichier.")
         else:
-            # Conversion des colonnes de date en format datetime
-            for col in date_cols_present:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-            
             # Calcul du TTF
             if 'Date de réclamation' in df.columns:
-                if 'Date d\'installation' in df.columns:
-                    df['TTF'] = (df['Date de réclamation'] - df['Date d\'installation']).dt.days
-                elif 'Date de fabrication' in df.columns:
-                    df['TTF'] = (df['Date de réclamation'] - df['Date de fabrication']).dt.days
+                ttf = compute_ttf(df)
+                if ttf is not None:
+                    df['TTF'] = ttf
                 else:
                     st.warning("Impossible de calculer le TTF - colonnes de date manquantes")
             
             # Traitement du numéro de série
             if 'Numéro de série' in df.columns:
                 # Extraction des informations du numéro de série
-                try:
-                    df['Mois'] = df['Numéro de série'].str[:2]
-                    df['Année'] = df['Numéro de série'].str[2:4]
-                    df['Numéro'] = df['Numéro de série'].str[4:]
-                except:
+                # Mois, année et numéro lus en une seule passe regex (format mmaaxxx)
+                serials = df['Numéro de série'].astype('string')
+                parts = serials.str.extract(r'^(\d{2})(\d{2})(\d+)$')
+                df['Mois'] = parts[0].astype('category')
+                df['Année'] = parts[1].astype('category')
+                df['Numéro'] = parts[2]
+                if (parts[0].isna() & serials.notna()).any():
                     st.warning("Format du numéro de série non conforme à mmaaxxx")
                 
                 # Calcul du MTTF en excluant les numéros de série en double
                 if 'TTF' in df.columns:
-                    # Identifier les numéros de série uniques
-                    unique_serials = df['Numéro de série'].value_counts()
-                    unique_serials = unique_serials[unique_serials == 1].index
+                    # Numéros de série présents une seule fois (multiplicité par ligne)
+                    unique_mask = df.groupby('Numéro de série')['Numéro de série'].transform('size').eq(1)
                     
                     # Calculer MTTF seulement pour les numéros de série uniques
-                    mttf = df[df['Numéro de série'].isin(unique_serials)]['TTF'].mean()
+                    mttf = df.loc[unique_mask, 'TTF'].mean()
                     st.metric("MTTF (jours)", round(mttf, 2))
             
             # Affichage des données transformées
@@ -68,17 +114,12 @@ if uploaded_file is not None:
             st.write(df)
             
             # Téléchargement des données transformées
-            output = pd.ExcelWriter('donnees_transformees.xlsx', engine='xlsxwriter')
-            df.to_excel(output, index=False)
-            output.close()
-            
-            with open('donnees_transformees.xlsx', 'rb') as f:
-                st.download_button(
-                    label="Télécharger les données transformées",
-                    data=f,
-                    file_name='donnees_transformees.xlsx',
-                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
+            st.download_button(
+                label="Télécharger les données transformées",
+                data=to_xlsx_bytes(df),
+                file_name='donnees_transformees.xlsx',
+                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
             
             # Visualisations
             st.subheader("Visualisations des Données")
@@ -89,35 +130,36 @@ if uploaded_file is not None:
             with col1:
                 # Histogramme du TTF
                 if 'TTF' in df.columns:
-                    fig, ax = plt.subplots()
-                    sns.histplot(df['TTF'].dropna(), bins=20, kde=True, ax=ax)
-                    ax.set_title("Distribution du TTF (jours)")
-                    st.pyplot(fig)
+                    st.altair_chart(ttf_histogram(df['TTF']), use_container_width=True)
                 
                 # Courbe des réclamations dans le temps
                 if 'Date de réclamation' in df.columns:
-                    fig, ax = plt.subplots()
-                    df['Date de réclamation'].value_counts().sort_index().plot(ax=ax)
-                    ax.set_title("Nombre de réclamations par date")
-                    ax.set_ylabel("Nombre de réclamations")
-                    st.pyplot(fig)
+                    st.write("Nombre de réclamations par date")
+                    # Comptage par jour sur les entiers datetime64 (résultat déjà trié)
+                    days = df['Date de réclamation'].dropna().to_numpy().astype('datetime64[D]')
+                    uniq, cnt = np.unique(days, return_counts=True)
+                    st.line_chart(pd.Series(cnt, index=uniq, name='Réclamations'))
             
             with col2:
                 # Répartition par produit
                 if 'Produit' in df.columns:
-                    fig, ax = plt.subplots()
-                    df['Produit'].value_counts().plot(kind='bar', ax=ax)
-                    ax.set_title("Répartition par Produit")
-                    ax.set_ylabel("Nombre de réclamations")
-                    st.pyplot(fig)
+                    st.write("Répartition par Produit")
+                    st.bar_chart(df['Produit'].value_counts())
                 
-                # Répartition des pannes
+                # Répartition des pannes (secteurs Vega-Lite, part en infobulle)
                 if 'Panne' in df.columns:
-                    fig, ax = plt.subplots(figsize=(8, 6))
-                    df['Panne'].value_counts().plot(kind='pie', autopct='%1.1f%%', ax=ax)
-                    ax.set_title("Répartition des Types de Panne")
-                    ax.set_ylabel("")
-                    st.pyplot(fig)
+                    panne_counts = df['Panne'].value_counts()
+                    pie_data = pd.DataFrame({
+                        'Panne': panne_counts.index.astype(str),
+                        'count': panne_counts.to_numpy(),
+                        'part': panne_counts.to_numpy() / panne_counts.sum()
+                    })
+                    pie = alt.Chart(pie_data, title="Répartition des Types de Panne").mark_arc().encode(
+                        theta='count:Q',
+                        color='Panne:N',
+                        tooltip=['Panne:N', 'count:Q', alt.Tooltip('part:Q', format='.1%')]
+                    )
+                    st.altair_chart(pie, use_container_width=True)
             
             # Analyse par catégorie si disponible
             if 'Catégorie' in df.columns:
@@ -133,10 +175,10 @@ if uploaded_file is not None:
                     st.write(f"MTTF pour la catégorie {selected_category}: {category_df['TTF'].mean():.2f} jours")
                 
                 # Visualisation des pannes dans cette catégorie
-                fig, ax = plt.subplots()
-                category_df['Panne'].value_counts().plot(kind='bar', ax=ax)
-                ax.set_title(f"Répartition des Pannes pour {selected_category}")
-                st.pyplot(fig)
+                st.write(f"Répartition des Pannes pour {selected_category}")
+                # Pannes absentes de la catégorie (compte nul) retirées
+                panne_counts = category_df['Panne'].value_counts()
+                st.bar_chart(panne_counts[panne_counts > 0])
     
     except Exception as e:
         st.error(f"Une erreur s'est produite lors du traitement du fichier: {str(e)}")
@@ -1,15 +1,18 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime
+from datetime import datetime, date
 import numpy as np
 from fpdf import FPDF
 from io import BytesIO
+import xlsxwriter
+from common import EXCEL_ENGINE, histogram_chart, write_sheet
 
 # Configuration de l'application
 st.set_page_config(layout="wide", page_title="Analyse Technique des Appareils")
 
+# Durée moyenne d'un mois en jours (conversion des durées en mois)
+DAYS_PER_MONTH = 30.44
+
 def main():
     st.title("📊 Analyse Complète des Appareils Techniques")
     
@@ -18,8 +21,9 @@ def main():
     
     if uploaded_file is not None:
         try:
-            df = load_and_validate_data(uploaded_file)
-            df = clean_and_prepare_data(df)
+            df = load_and_validate_data(uploaded_file.getvalue())
+            # Date du jour passée en argument : elle fait partie de la clé du cache
+            df = clean_and_prepare_data(df, date.today())
             
             # Affichage des données brutes
             st.header("📋 Données Brutes")
@@ -33,6 +37,8 @@ def main():
                 age_comment = st.text_area("Interprétation Âge des appareils")
             
             filtered_df = apply_filters(df, model_filter, filiale_filter)
+            # Indicateurs calculés une fois, partagés par l'écran et les exports
+            stats = compute_key_stats(filtered_df)
             
             # Tableau de répartition
             st.header("📊 Répartition par Filiale")
@@ -40,22 +46,23 @@ def main():
             
             # Indicateurs
             st.header("🔍 Indicateurs Clés")
-            show_key_metrics(filtered_df)
+            show_key_metrics(stats)
             
             # Visualisations
             st.header("📈 Visualisations")
-            show_visualizations(filtered_df, ttf_comment, age_comment)
+            show_visualizations(filtered_df, stats, ttf_comment, age_comment)
             
             # Export
             st.header("💾 Export des Résultats")
-            show_export_options(filtered_df, global_comment, ttf_comment, age_comment)
+            show_export_options(filtered_df, stats, global_comment, ttf_comment, age_comment)
             
         except Exception as e:
             st.error(f"Erreur: {str(e)}")
 
-def load_and_validate_data(uploaded_file):
-    """Charge et valide les données"""
-    df = pd.read_excel(uploaded_file)
+@st.cache_data(show_spinner=False)
+def load_and_validate_data(file_bytes):
+    """Charge et valide les données (cache sur le contenu du fichier)"""
+    df = pd.read_excel(BytesIO(file_bytes), engine=EXCEL_ENGINE)
     required_columns = [
         'modèle', 'SN', 'FabricationDate', 'refPays', 'filiale',
         'installationDate', 'Lastconnexion', 'incident', 'incidentDate'
@@ -65,111 +72,155 @@ def load_and_validate_data(uploaded_file):
         raise ValueError(f"Colonnes manquantes: {', '.join(missing_cols)}")
     return df
 
-def clean_and_prepare_data(df):
-    """Nettoie et prépare les données"""
+@st.cache_data(show_spinner=False)
+def clean_and_prepare_data(df, today):
+    """Nettoie et prépare les données (cache sur le contenu du DataFrame et la date du jour)"""
     # Conversion des dates
     date_cols = ['FabricationDate', 'installationDate', 'incidentDate', 'Lastconnexion']
     for col in date_cols:
-        df[col] = pd.to_datetime(df[col], errors='coerce')
+        # Colonnes déjà lues en datetime64 par le lecteur Excel : rien à analyser
+        if not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce', cache=True)
     
     # Calcul des métriques
-    today = datetime.now()
+    today = np.datetime64(today, 'ns')
     
-    # Time to Failure selon la nouvelle règle
-    ttf_inst = (df['incidentDate'] - df['installationDate']).dt.days / 30.44
-    ttf_fab = (df['incidentDate'] - df['FabricationDate']).dt.days / 30.44
+    # Time to Failure selon la nouvelle règle : jours entiers depuis l'installation
+    # s'ils sont positifs, sinon depuis la fabrication. Calcul sur les tableaux
+    # datetime64 (NaT -> NaN), donc NaN pour les appareils sans incident
+    day = np.timedelta64(1, 'D')
+    incident = df['incidentDate'].to_numpy()
+    ttf = np.floor((incident - df['installationDate'].to_numpy()) / day)
+    # Repli sur la fabrication calculé pour les seules lignes concernées, mise à l'échelle sur place
+    fallback = ~(ttf > 0)
+    ttf[fallback] = np.floor((incident[fallback] - df['FabricationDate'].to_numpy()[fallback]) / day)
+    ttf /= DAYS_PER_MONTH
+    df['Time_to_Failure'] = ttf
     
-    # On calcule TTF seulement pour les appareils avec incident
-    df['Time_to_Failure'] = np.where(
-        df['incidentDate'].notna(),
-        np.where(ttf_inst > 0, ttf_inst, ttf_fab),
-        np.nan
-    )
+    # Âges (en mois) : même soustraction datetime64 que le TTF, sans passer par .dt.days
+    df['Age_installation'] = np.floor((today - df['installationDate'].to_numpy()) / day) / DAYS_PER_MONTH
+    df['Age_fabrication'] = np.floor((today - df['FabricationDate'].to_numpy()) / day) / DAYS_PER_MONTH
     
-    # Âges (en mois)
-    df['Age_installation'] = (today - df['installationDate']).dt.days / 30.44
-    df['Age_fabrication'] = (today - df['FabricationDate']).dt.days / 30.44
+    # Colonnes de regroupement et de filtre en catégories (codes entiers). Le SN,
+    # quasi unique par appareil, reste en texte
+    for col in ('modèle', 'filiale', 'refPays'):
+        df[col] = df[col].astype('category')
     
     return df
 
 def create_filters(df):
     """Crée les widgets de filtre"""
+    # Options lues dans les catégories (valeurs distinctes, sans NaN) : aucun parcours des lignes
     return (
-        st.selectbox("Modèle", ['Tous'] + sorted(df['modèle'].dropna().unique().tolist())),
-        st.selectbox("Filiale", ['Tous'] + sorted(df['filiale'].dropna().unique().tolist()))
+        st.selectbox("Modèle", ['Tous'] + sorted(df['modèle'].cat.categories.tolist())),
+        st.selectbox("Filiale", ['Tous'] + sorted(df['filiale'].cat.categories.tolist()))
     )
 
 def apply_filters(df, model, filiale):
     """Applique les filtres"""
-    filtered = df.copy()
+    # Masque unique combiné, une seule sélection ; aucune copie sans filtre actif.
+    # Comparaison sur les codes des catégories plutôt que sur les chaînes
+    def category_mask(series, value):
+        return series.cat.codes.to_numpy() == series.cat.categories.get_loc(value)
+    
+    mask = np.ones(len(df), dtype=bool)
     if model != 'Tous':
-        filtered = filtered[filtered['modèle'] == model]
+        mask &= category_mask(df['modèle'], model)
     if filiale != 'Tous':
-        filtered = filtered[filtered['filiale'] == filiale]
-    return filtered
+        mask &= category_mask(df['filiale'], filiale)
+    return df if mask.all() else df.loc[mask]
+
+@st.cache_data(show_spinner=False)
+def build_filiale_table(df):
+    """Agrège les indicateurs par filiale (cache sur le contenu du DataFrame filtré)"""
+    # Agrégations nommées natives (sans lambda), arrondies en une fois ; les NaN
+    # sont remplacés par 'N/A' seulement à l'affichage
+    return df.groupby('filiale', observed=True, sort=False).agg(
+        Nombre=('SN', 'count'),
+        **{'TTF moyen (mois)': ('Time_to_Failure', 'mean')},
+        **{'TTF max (mois)': ('Time_to_Failure', 'max')},
+        **{'TTF min (mois)': ('Time_to_Failure', 'min')},
+        **{'Âge moyen (mois)': ('Age_fabrication', 'mean')}
+    ).round(2).sort_values('Nombre', ascending=False)
+
+@st.cache_data(show_spinner=False)
+def filiale_table_html(table):
+    """Rendu HTML du tableau stylé (dégradé calculé une fois par contenu)"""
+    return table.style.background_gradient(cmap='Blues').format(precision=2, na_rep='N/A').to_html()
 
 def show_filiale_table(df):
     """Affiche le tableau de répartition par filiale"""
-    table = df.groupby('filiale').agg(
-        Nombre=('SN', 'count'),
-        **{'TTF moyen (mois)': ('Time_to_Failure', lambda x: round(x.mean(), 2) if x.notna().any() else 'N/A')},
-        **{'TTF max (mois)': ('Time_to_Failure', lambda x: round(x.max(), 2) if x.notna().any() else 'N/A')},
-        **{'TTF min (mois)': ('Time_to_Failure', lambda x: round(x.min(), 2) if x.notna().any() else 'N/A')},
-        **{'Âge moyen (mois)': ('Age_fabrication', lambda x: round(x.mean(), 2))}
-    ).sort_values('Nombre', ascending=False)
-    
-    st.dataframe(table.style.background_gradient(cmap='Blues'), height=400)
+    html = filiale_table_html(build_filiale_table(df))
+    st.markdown(f'<div style="max-height: 400px; overflow: auto">{html}</div>', unsafe_allow_html=True)
+
+@st.cache_data(show_spinner=False)
+def compute_key_stats(df):
+    """Calcule les indicateurs clés (cache sur le contenu du DataFrame filtré)"""
+    # Calcul des stats TTF seulement pour les appareils avec incident : un seul
+    # masque NaN sur le tableau numpy, partagé par toutes les réductions
+    ttf = df['Time_to_Failure'].to_numpy(dtype='float64')
+    ttf = ttf[~np.isnan(ttf)]
+    has_ttf = ttf.size > 0
+    return {
+        'total': len(df),
+        'incidents': ttf.size,
+        'ttf_mean': ttf.mean() if has_ttf else None,
+        'ttf_max': ttf.max() if has_ttf else None,
+        'ttf_min': ttf.min() if has_ttf else None,
+        'age_mean': df['Age_fabrication'].mean()
+    }
+
+def round_stat(value):
+    """Arrondit un indicateur à 2 décimales, 'N/A' s'il est absent"""
+    return round(float(value), 2) if value is not None and pd.notna(value) else 'N/A'
 
-def show_key_metrics(df):
+def show_key_metrics(stats):
     """Affiche les indicateurs clés"""
     cols = st.columns(4)
     
-    # Calcul des stats TTF seulement pour les appareils avec incident
-    ttf_data = df['Time_to_Failure'].dropna()
+    def fmt(value):
+        return f"{value:.2f}" if value is not None else "N/A"
     
     metrics = [
-        ("Appareils analysés", len(df)),
-        ("Appareils avec incidents", ttf_data.count()),
-        ("TTF moyen (mois)", f"{ttf_data.mean():.2f}" if not ttf_data.empty else "N/A"),
-        ("TTF max (mois)", f"{ttf_data.max():.2f}" if not ttf_data.empty else "N/A"),
-        ("TTF min (mois)", f"{ttf_data.min():.2f}" if not ttf_data.empty else "N/A"),
-        ("Âge moyen (mois)", f"{df['Age_fabrication'].mean():.2f}")
+        ("Appareils analysés", stats['total']),
+        ("Appareils avec incidents", stats['incidents']),
+        ("TTF moyen (mois)", fmt(stats['ttf_mean'])),
+        ("TTF max (mois)", fmt(stats['ttf_max'])),
+        ("TTF min (mois)", fmt(stats['ttf_min'])),
+        ("Âge moyen (mois)", fmt(stats['age_mean']))
     ]
     
     for i, (label, value) in enumerate(metrics):
         with cols[i % 4]:
             st.metric(label, value)
 
-def show_visualizations(df, ttf_comment, age_comment):
+def plot_histogram(values, title, xlabel):
+    """Histogramme Vega-Lite (classes et densité précalculées, mises en cache)"""
+    chart = histogram_chart(values.rename(xlabel)).properties(title=title)
+    st.altair_chart(chart, use_container_width=True)
+
+def show_visualizations(df, stats, ttf_comment, age_comment):
     """Affiche les graphiques"""
     col1, col2 = st.columns(2)
     
     with col1:
-        if df['Time_to_Failure'].notna().any():
-            fig = plt.figure(figsize=(10, 6))
-            sns.histplot(df['Time_to_Failure'].dropna(), bins=20, kde=True)
-            plt.title("Distribution du Time to Failure")
-            plt.xlabel("Mois avant incident")
-            st.pyplot(fig)
+        if stats['incidents']:
+            plot_histogram(df['Time_to_Failure'], "Distribution du Time to Failure", "Mois avant incident")
             if ttf_comment:
                 st.info(f"💬 {ttf_comment}")
         else:
             st.warning("Aucune donnée de Time to Failure disponible")
     
     with col2:
-        fig = plt.figure(figsize=(10, 6))
-        sns.histplot(df['Age_fabrication'].dropna(), bins=20, kde=True)
-        plt.title("Distribution de l'âge des appareils")
-        plt.xlabel("Âge (mois)")
-        st.pyplot(fig)
+        plot_histogram(df['Age_fabrication'], "Distribution de l'âge des appareils", "Âge (mois)")
         if age_comment:
             st.info(f"💬 {age_comment}")
 
-def show_export_options(df, global_comment, ttf_comment, age_comment):
+def show_export_options(df, stats, global_comment, ttf_comment, age_comment):
     """Gère l'export des données"""
     # Export Excel
     st.subheader("Export Excel")
-    excel_data = export_to_excel(df, global_comment, ttf_comment, age_comment)
+    excel_data = export_to_excel(df, stats, global_comment, ttf_comment, age_comment)
     st.download_button(
         label="Télécharger Excel",
         data=excel_data,
@@ -180,7 +231,7 @@ def show_export_options(df, global_comment, ttf_comment, age_comment):
     # Export PDF
     st.subheader("Export PDF")
     if st.button("Générer le rapport PDF"):
-        pdf_report = create_pdf_report(df, global_comment, ttf_comment, age_comment)
+        pdf_report = create_pdf_report(df, stats, global_comment, ttf_comment, age_comment)
         st.download_button(
             label="Télécharger PDF",
             data=pdf_report,
@@ -188,44 +239,37 @@ def show_export_options(df, global_comment, ttf_comment, age_comment):
             mime='application/pdf'
         )
 
-def export_to_excel(df, global_comment, ttf_comment, age_comment):
+def export_to_excel(df, stats, global_comment, ttf_comment, age_comment):
     """Exporte en Excel"""
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Données', index=False)
-        
-        # Stats TTF
-        ttf_data = df['Time_to_Failure'].dropna()
-        stats_data = {
-            'Statistique': [
-                'Appareils totaux',
-                'Appareils avec incidents',
-                'TTF moyen (mois)',
-                'TTF max (mois)',
-                'TTF min (mois)',
-                'Âge moyen (mois)'
-            ],
-            'Valeur': [
-                len(df),
-                ttf_data.count(),
-                round(ttf_data.mean(), 2) if not ttf_data.empty else 'N/A',
-                round(ttf_data.max(), 2) if not ttf_data.empty else 'N/A',
-                round(ttf_data.min(), 2) if not ttf_data.empty else 'N/A',
-                round(df['Age_fabrication'].mean(), 2)
-            ]
-        }
-        pd.DataFrame(stats_data).to_excel(writer, sheet_name='Statistiques', index=False)
-        
-        # Commentaires
-        comments = {
-            'Type': ['Général', 'Time to Failure', 'Âge des appareils'],
-            'Commentaire': [global_comment, ttf_comment, age_comment]
-        }
-        pd.DataFrame(comments).to_excel(writer, sheet_name='Commentaires', index=False)
-        
+    # Écriture en flux (constant_memory) : les lignes sont écrites dans l'ordre
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy'
+    })
+    write_sheet(workbook, 'Données', df)
+    
+    # Stats TTF (mêmes indicateurs que l'écran)
+    write_sheet(workbook, 'Statistiques', pd.DataFrame([
+        ('Appareils totaux', int(stats['total'])),
+        ('Appareils avec incidents', int(stats['incidents'])),
+        ('TTF moyen (mois)', round_stat(stats['ttf_mean'])),
+        ('TTF max (mois)', round_stat(stats['ttf_max'])),
+        ('TTF min (mois)', round_stat(stats['ttf_min'])),
+        ('Âge moyen (mois)', round_stat(stats['age_mean']))
+    ], columns=['Statistique', 'Valeur']))
+    
+    # Commentaires
+    write_sheet(workbook, 'Commentaires', pd.DataFrame([
+        ('Général', global_comment),
+        ('Time to Failure', ttf_comment),
+        ('Âge des appareils', age_comment)
+    ], columns=['Type', 'Commentaire']))
+    
+    workbook.close()
     return output.getvalue()
 
-def create_pdf_report(df, global_comment, ttf_comment, age_comment):
+def create_pdf_report(df, key_stats, global_comment, ttf_comment, age_comment):
     """Crée un rapport PDF professionnel"""
     pdf = FPDF()
     pdf.add_page()
@@ -243,15 +287,13 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
     pdf.cell(200, 10, txt="Statistiques Clés", ln=1)
     pdf.set_font("Arial", size=10)
     
-    ttf_data = df['Time_to_Failure'].dropna()
-    
     stats = [
-        f"Appareils analysés: {len(df)}",
-        f"Appareils avec incidents: {ttf_data.count()}",
-        f"TTF moyen: {round(ttf_data.mean(), 2) if not ttf_data.empty else 'N/A'} mois",
-        f"TTF max: {round(ttf_data.max(), 2) if not ttf_data.empty else 'N/A'} mois",
-        f"TTF min: {round(ttf_data.min(), 2) if not ttf_data.empty else 'N/A'} mois",
-        f"Âge moyen: {round(df['Age_fabrication'].mean(), 2)} mois"
+        f"Appareils analysés: {key_stats['total']}",
+        f"Appareils avec incidents: {key_stats['incidents']}",
+        f"TTF moyen: {round_stat(key_stats['ttf_mean'])} mois",
+        f"TTF max: {round_stat(key_stats['ttf_max'])} mois",
+        f"TTF min: {round_stat(key_stats['ttf_min'])} mois",
+        f"Âge moyen: {round_stat(key_stats['age_mean'])} mois"
     ]
     
     for stat in stats:
@@ -262,28 +304,25 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
     pdf.set_font("Arial", 'B', 14)
     pdf.cell(200, 10, txt="Répartition par Filiale", ln=1)
     
-    filiale_table = df.groupby('filiale').agg(
-        Nombre=('SN', 'count'),
-        **{'TTF moyen (mois)': ('Time_to_Failure', lambda x: round(x.mean(), 2) if x.notna().any() else 'N/A'},
-        **{'TTF max (mois)': ('Time_to_Failure', lambda x: round(x.max(), 2) if x.notna().any() else 'N/A'},
-        **{'TTF min (mois)': ('Time_to_Failure', lambda x: round(x.min(), 2) if x.notna().any() else 'N/A'},
-        **{'Âge moyen (mois)': ('Age_fabrication', lambda x: round(x.mean(), 2))}
-    ).reset_index()
+    # Même agrégat que le tableau affiché (servi par le cache)
+    filiale_table = build_filiale_table(df).reset_index()
     
-    # En-têtes du tableau
-    pdf.set_font("Arial", 'B', 10)
-    col_width = [50, 25, 25, 25, 25, 25]
-    headers = filiale_table.columns
-    for i, header in enumerate(headers):
-        pdf.cell(col_width[i], 10, str(header), border=1, align='C')
-    pdf.ln()
+    # Cellules formatées en bloc : '%.2f' vectorisé sur les colonnes numériques,
+    # N/A pour les filiales sans incident
+    cells = [filiale_table['filiale'].astype(str).to_numpy(),
+             filiale_table['Nombre'].astype(str).to_numpy()]
+    for col in filiale_table.columns[2:]:
+        values = filiale_table[col].to_numpy(dtype='float64')
+        cells.append(np.where(np.isnan(values), 'N/A', np.char.mod('%.2f', values)))
     
-    # Données du tableau
+    # Tableau natif fpdf2 : largeurs calculées une fois, en-têtes en gras
     pdf.set_font("Arial", size=10)
-    for _, row in filiale_table.iterrows():
-        for i, val in enumerate(row):
-            pdf.cell(col_width[i], 10, str(val), border=1)
-        pdf.ln()
+    col_width = (50, 25, 25, 25, 25, 25)
+    with pdf.table(col_widths=col_width, width=sum(col_width), align='LEFT',
+                   line_height=10, text_align='LEFT') as table:
+        table.row([str(header) for header in filiale_table.columns])
+        for row in zip(*cells):
+            table.row(row)
     
     # Commentaires
     if global_comment or ttf_comment or age_comment:
@@ -311,7 +350,8 @@ def create_pdf_report(df, global_comment, ttf_comment, age_comment):
             pdf.set_font("Arial", size=10)
             pdf.multi_cell(0, 8, txt=age_comment)
     
-    return pdf.output(dest='S').encode('latin-1')
+    # fpdf2 renvoie directement les octets du document
+    return bytes(pdf.output())
 
 if __name__ == "__main__":
     main()